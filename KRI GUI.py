@@ -1,12 +1,16 @@
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
+from tkinter.ttk import Progressbar
 from datetime import datetime
-from threading import Thread
-import zipfile
-import openpyxl
-from io import BytesIO
+from threading import Event, Thread
 import os
+import queue
+
+from taskautomate.kri import ProcessingCancelled, process_data
+
+# How often (ms) the Tk main loop picks up progress events from the processing thread
+POLL_INTERVAL_MS = 100
 
 
 class ExcelProcessingApp:
@@ -19,6 +23,14 @@ class ExcelProcessingApp:
         self.zip_path2 = tk.StringVar()
         self.selected_month = tk.StringVar(value="January")  # Default selected month is January
         self.year = tk.StringVar(value=datetime.now().year)  # Default year is the current year
+        self.streaming = tk.BooleanVar(value=False)  # Low-memory streaming mode for large exports
+        self.fast_xlsx = tk.BooleanVar(value=False)  # Column-selective xlsx reader instead of openpyxl
+        self.workers = tk.StringVar(value=os.cpu_count() or 1)  # Parallel worker processes for daily sheets
+
+        # State of the running job: events from the processing thread and the flag that cancels it
+        self.events = queue.Queue()
+        self.cancel_event = None
+        self.progress_window = None
 
         # Create and set up GUI elements
         self.create_widgets()
@@ -44,8 +56,21 @@ class ExcelProcessingApp:
         tk.Label(self.master, text="Year:").grid(row=3, column=0, padx=10, pady=10)
         tk.Entry(self.master, textvariable=self.year, width=10).grid(row=3, column=1, padx=10, pady=10)
 
+        # Streaming mode checkbox
+        tk.Checkbutton(self.master, text="Low-memory streaming mode", variable=self.streaming).grid(row=4, column=1,
+                                                                                                  padx=10, pady=10)
+
+        # Fast reader checkbox
+        tk.Checkbutton(self.master, text="Fast column reader for xlsx", variable=self.fast_xlsx).grid(row=5, column=1,
+                                                                                                    padx=10, pady=10)
+
+        # Worker count input
+        tk.Label(self.master, text="Workers:").grid(row=6, column=0, padx=10, pady=10)
+        tk.Entry(self.master, textvariable=self.workers, width=10).grid(row=6, column=1, padx=10, pady=10)
+
         # Process Button
-        tk.Button(self.master, text="Process", command=self.process_data).grid(row=4, column=1, pady=20)
+        self.process_button = tk.Button(self.master, text="Process", command=self.process_data)
+        self.process_button.grid(row=7, column=1, pady=20)
 
     def browse_zip1(self):
         file_path = filedialog.askopenfilename(filetypes=[("Zip Files", "*.zip")])
@@ -62,164 +87,102 @@ class ExcelProcessingApp:
         zip_path2 = self.zip_path2.get()
         selected_month = self.selected_month.get()
         year = self.year.get()
+        streaming = self.streaming.get()
+        fast_xlsx = self.fast_xlsx.get()
 
         # Check if file paths are provided
         if not zip_path1 or not zip_path2:
             messagebox.showerror("Error", "Please select both zip files.")
             return
 
-        # Run processing in a separate thread to keep the GUI responsive
-        Thread(target=self.process_in_thread, args=(zip_path1, zip_path2, selected_month, year)).start()
-
-    def process_in_thread(self, zip_path1, zip_path2, selected_month, year):
+        # Check the worker count
         try:
-            # Open a separate window to show progress
-            progress_window = tk.Toplevel(self.master)
-            progress_window.title("Processing...")
-            progress_label = tk.Label(progress_window, text="Processing data. Please wait...")
-            progress_label.pack(pady=20)
-
-            # Process data using the provided function
-            process_data(zip_path1, zip_path2, selected_month, year)
-
-            # Close the progress window when processing is complete
-            progress_window.destroy()
-
-            # Show completion message
-            messagebox.showinfo("Success", "Processing completed. Result saved.")
+            workers = max(1, int(self.workers.get()))
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a whole number of workers.")
+            return
 
+        # Run processing in a separate thread to keep the GUI responsive. Tk is only touched from the main loop,
+        # which picks up the thread's progress events in poll_events.
+        self.cancel_event = Event()
+        self.open_progress_window()
+        self.process_button.config(state='disabled')
+        Thread(target=self.process_in_thread, args=(zip_path1, zip_path2, selected_month, year, streaming, workers,
+                                                     fast_xlsx), daemon=True).start()
+        self.master.after(POLL_INTERVAL_MS, self.poll_events)
+
+    def process_in_thread(self, zip_path1, zip_path2, selected_month, year, streaming=False, workers=1,
+                          fast_xlsx=False):
+        # Runs on the processing thread; reports back only through self.events
+        try:
+            output_path = process_data(zip_path1, zip_path2, selected_month, year, streaming, workers,
+                                       fast_xlsx=fast_xlsx, report_path=f'Result_{selected_month}_{year}_report.json',
+                                       progress=lambda event: self.events.put(('progress', event)),
+                                       cancel_event=self.cancel_event)
+            self.events.put(('done', output_path))
+        except ProcessingCancelled:
+            self.events.put(('cancelled', None))
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {str(e)}")
-
+            self.events.put(('error', str(e)))
+
+    def open_progress_window(self):
+        # Separate window showing the progress of the run, with a button to cancel it
+        self.progress_window = tk.Toplevel(self.master)
+        self.progress_window.title("Processing...")
+        self.progress_window.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.progress_label = tk.Label(self.progress_window, text="Listing daily sheets...", width=50, anchor='w')
+        self.progress_label.pack(padx=10, pady=(10, 0))
+        self.progress_bar = Progressbar(self.progress_window, orient=tk.HORIZONTAL, length=300, mode='determinate')
+        self.progress_bar.pack(padx=10, pady=10)
+        self.rate_label = tk.Label(self.progress_window, text="", width=50, anchor='w')
+        self.rate_label.pack(padx=10)
+        self.member_label = tk.Label(self.progress_window, text="", width=50, anchor='w')
+        self.member_label.pack(padx=10)
+        self.cancel_button = tk.Button(self.progress_window, text="Cancel", command=self.cancel)
+        self.cancel_button.pack(pady=10)
+
+    def cancel(self):
+        # Sheets being scanned stop within a thousand rows; the thread then reports the run as cancelled
+        self.cancel_event.set()
+        self.cancel_button.config(state='disabled')
+        self.progress_label.config(text="Cancelling...")
+
+    def poll_events(self):
+        while True:
+            try:
+                kind, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                self.show_progress(payload)
+                continue
+
+            # The run is over: close the progress window and report the outcome
+            self.progress_window.destroy()
+            self.process_button.config(state='normal')
+            if kind == 'done':
+                messagebox.showinfo("Success", f"Processing completed. Result saved to {payload}.")
+            elif kind == 'cancelled':
+                messagebox.showinfo("Cancelled", "Processing cancelled.")
+            else:
+                messagebox.showerror("Error", f"An error occurred: {payload}")
+            return
+        self.master.after(POLL_INTERVAL_MS, self.poll_events)
 
-def process_data(zip_path1, zip_path2, month, year):
-    try:
-        # Create a new workbook to store the result
-        result_wb = openpyxl.Workbook()
-
-        # Process the first zip file (sheets with 'deviceAction' column)
-        process_query1(zip_path1, result_wb, month, year)
+    def show_progress(self, event):
+        if self.cancel_event.is_set():
+            return
+        self.progress_label.config(text=f"Files done: {event['files_done']} of {event['files_total']}")
+        self.progress_bar['value'] = event['files_done'] / event['files_total'] * 100 if event['files_total'] else 0
+        eta = format_duration(event['eta']) if event['eta'] is not None else '-'
+        self.rate_label.config(text=f"{event['rows_per_second']:,.0f} rows/s, about {eta} left")
+        if event['member']:
+            self.member_label.config(text=f"Last file done: {event['member']}")
 
-        # Process the second zip file (sheets with 'Event Time' and 'message' columns)
-        process_query2(zip_path2, result_wb, month, year)
 
-        # Save the result workbook
-        result_wb.save(f'Result_{month}_{year}.xlsx')
-
-        print("Processing completed. Result saved.")
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-
-
-def process_query1(zip_path, result_wb, month, year):
-    # Open the zip file (sheets with 'deviceAction' column)
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        # Create a new sheet for the query in the result workbook
-        result_sheet = result_wb.create_sheet(title='Query1')
-
-        # Write headers to the result sheet
-        result_sheet.append(['Date', 'Blocked Count'])
-
-        # Dictionaries to store blocked counts for each date
-        blocked_counts = {}
-
-        # Process each Excel sheet in the zip file
-        for file_name in zip_ref.namelist():
-            if file_name.endswith('.xlsx'):
-                date_str = os.path.splitext(os.path.basename(file_name))[0]
-
-                # Parse date string to datetime object
-                try:
-                    date = datetime.strptime(f"{month} {date_str}, {year}", "%B %d, %Y").date()
-                except ValueError:
-                    print(f"Invalid date format for file: {file_name}")
-                    continue
-
-                # Read the Excel sheet from the zip file
-                with zip_ref.open(file_name) as sheet_file:
-                    wb = openpyxl.load_workbook(BytesIO(sheet_file.read()))
-                    sheet = wb.active
-
-                    # Get the column index of 'deviceAction'
-                    device_action_col_index = None
-                    for col_index, col in enumerate(sheet.iter_cols(), 1):
-                        if col[0].value == 'deviceAction':
-                            device_action_col_index = col_index
-                            break
-
-                    if device_action_col_index is not None:
-                        # Calculate the count of rows containing 'blocked' in the 'deviceAction' column
-                        blocked_count = sum(1 for row in sheet.iter_rows(min_row=2, max_col=device_action_col_index) if
-                                            row[device_action_col_index - 1].value == 'blocked')
-                        blocked_counts[date] = blocked_count
-
-        # Sort dates in ascending order
-        sorted_dates = sorted(blocked_counts.keys())
-
-        # Write the result to the new sheet
-        for date in sorted_dates:
-            result_sheet.append([date.strftime("%Y-%m-%d"), blocked_counts[date]])
-
-        # Add a row for the total sum of blocked counts
-        result_sheet.append(['Total', sum(blocked_counts.values())])
-
-
-def process_query2(zip_path, result_wb, month, year):
-    # Open the zip file (sheets with 'Event Time' and 'message' columns)
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        # Create a new sheet for the query in the result workbook
-        result_sheet = result_wb.create_sheet(title='Query2')
-
-        # Write headers to the result sheet
-        result_sheet.append(['Date', 'Total Event Time Count', 'Filtered Message Count'])
-
-        # Dictionaries to store counts for each date
-        total_event_time_counts = {}
-        filtered_message_counts = {}
-
-        # Process each Excel sheet in the zip file
-        for file_name in zip_ref.namelist():
-            if file_name.endswith('.xlsx'):
-                date_str = os.path.splitext(os.path.basename(file_name))[0]
-
-                # Parse date string to datetime object
-                try:
-                    date = datetime.strptime(f"{month} {date_str}, {year}", "%B %d, %Y").date()
-                except ValueError:
-                    print(f"Invalid date format for file: {file_name}")
-                    continue
-
-                # Read the Excel sheet from the zip file
-                with zip_ref.open(file_name) as sheet_file:
-                    wb = openpyxl.load_workbook(BytesIO(sheet_file.read()))
-                    sheet = wb.active
-
-                    # Get the column indices of 'Event Time' and 'message'
-                    event_time_col_index = 1  # Assuming 'Event Time' is in column A
-                    message_col_index = 12  # Assuming 'message' is in column L
-
-                    # Calculate the total count of 'Event Time'
-                    total_event_time_count = sheet.max_row - 1  # Exclude header row
-                    total_event_time_counts[date] = total_event_time_count
-
-                    # Calculate the count of rows containing specified words in 'message' column
-                    filtered_message_count = sum(
-                        1 for row in sheet.iter_rows(min_row=2, max_col=message_col_index)
-                        if any(word in str(row[message_col_index - 1].value).lower() for word in
-                               ['tcp', 'sql injection', 'brute force'])
-                    )
-                    filtered_message_counts[date] = filtered_message_count
-
-        # Sort dates in ascending order
-        sorted_dates = sorted(total_event_time_counts.keys())
-
-        # Write the result to the new sheet
-        for date in sorted_dates:
-            result_sheet.append(
-                [date.strftime("%Y-%m-%d"), total_event_time_counts.get(date, 0), filtered_message_counts.get(date, 0)])
-
-        # Add a row for the total sum of counts
-        result_sheet.append(['Total', sum(total_event_time_counts.values()), sum(filtered_message_counts.values())])
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    return f"{minutes}:{seconds:02d}"
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local stand-in for the VirusTotal v3 IP address endpoint, so IP checker benchmarks never touch the
+# network. Every lookup answers with a deterministic malicious count after an optional fixed latency.
+
+IP_PATH = re.compile(r'^/api/v3/ip_addresses/([^/?]+)')
+
+
+class FakeVirusTotalHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        match = IP_PATH.match(self.path)
+        if not match:
+            self.send_error(404)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        malicious = random.Random(match.group(1)).randrange(5)
+        body = json.dumps({'data': {'id': match.group(1), 'type': 'ip_address', 'attributes': {
+            'last_analysis_stats': {'harmless': 60, 'malicious': malicious, 'suspicious': 0,
+                                    'undetected': 20, 'timeout': 0}}}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeVirusTotal:
+    # Runs the fake endpoint on a free localhost port in a background thread:
+    #     with FakeVirusTotal() as server:
+    #         os.environ['VIRUSTOTAL_API_URL'] = server.api_url
+    def __init__(self, latency=0.0):
+        handler = type('Handler', (FakeVirusTotalHandler,), {'latency': latency})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.api_url = f'http://127.0.0.1:{self.server.server_port}/api/v3'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,96 @@
+import csv
+import gzip
+import io
+import os
+import random
+import zipfile
+from datetime import datetime, timedelta
+
+import openpyxl
+
+
+# Synthetic fixtures shaped like the real inputs of the KRI, matrix and IP checker scripts
+
+DEVICE_ACTIONS = ['blocked', 'allowed', 'alerted', None]
+MESSAGES = ['TCP port scan detected', 'SQL injection attempt on /login', 'Brute force login failure',
+            'Policy allowed connection', 'Malware signature update', None]
+COUNTRIES = ['United States', 'India', 'Germany', 'Brazil', 'China', 'Russia', 'France', 'Nigeria', 'Japan',
+             'Australia', 'Canada', 'Mexico', 'Spain', 'Italy', 'Netherlands', 'Singapore']
+
+
+def sheet_bytes(header, rows, file_format='xlsx'):
+    # Serialize one daily sheet as xlsx (written in write-only mode to keep generation fast) or CSV
+    if file_format == 'xlsx':
+        wb = openpyxl.Workbook(write_only=True)
+        sheet = wb.create_sheet()
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+        data = io.BytesIO()
+        wb.save(data)
+        return data.getvalue()
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(header)
+    writer.writerows(['' if value is None else value for value in row] for row in rows)
+    data = text.getvalue().encode('utf-8')
+    return gzip.compress(data) if file_format == 'csv.gz' else data
+
+
+def make_kri_zips(directory, days=30, rows=1000, file_format='xlsx', seed=0):
+    # Query1 zip: daily sheets with a 'deviceAction' column.
+    # Query2 zip: daily sheets with 'Event Time' in column A and 'message' in column L.
+    # Members are named by day of month ('01.xlsx', ...) like the SIEM exports.
+    rng = random.Random(seed)
+    zip_path1 = os.path.join(directory, f'Query1_{file_format}.zip')
+    zip_path2 = os.path.join(directory, f'Query2_{file_format}.zip')
+    with zipfile.ZipFile(zip_path1, 'w', zipfile.ZIP_DEFLATED) as zip1, \
+            zipfile.ZipFile(zip_path2, 'w', zipfile.ZIP_DEFLATED) as zip2:
+        for day in range(1, days + 1):
+            member = f'{day:02d}.{file_format}'
+            query1_rows = ([f'2023-11-{day:02d} 00:00:00', f'10.0.{rng.randrange(256)}.{rng.randrange(256)}',
+                            'firewall', rng.choice(DEVICE_ACTIONS)] for _ in range(rows))
+            zip1.writestr(member, sheet_bytes(['Event Time', 'sourceAddress', 'deviceProduct', 'deviceAction'],
+                                              query1_rows, file_format))
+            query2_rows = ([f'2023-11-{day:02d} 00:00:00'] + [f'field{col}' for col in range(2, 12)] +
+                           [rng.choice(MESSAGES)] for _ in range(rows))
+            zip2.writestr(member, sheet_bytes(['Event Time'] + [f'Field {col}' for col in range(2, 12)] +
+                                              ['message'], query2_rows, file_format))
+    return zip_path1, zip_path2
+
+
+def make_matrix_workbook(path, rows=10000, users=1000, countries=4, seed=0):
+    # 'matrix' sheet with the columns process_excel uses plus a few it ignores. Every user gets a home
+    # country; roughly one event in ten comes from one of up to `countries` other countries.
+    rng = random.Random(seed)
+    country_names = COUNTRIES[:max(1, min(countries, len(COUNTRIES)))]
+    home = {user: rng.choice(country_names) for user in range(users)}
+    start = datetime(2023, 11, 1)
+
+    wb = openpyxl.Workbook(write_only=True)
+    sheet = wb.create_sheet(title='matrix')
+    sheet.append(['End Time', 'Attacker User ID', 'Attacker User Name', 'Attacker Address',
+                  'Attacker Geo Country Name', 'Name', 'Device Action', 'Device Vendor', 'Priority'])
+    for _ in range(rows):
+        user = rng.randrange(users)
+        country = rng.choice(country_names) if rng.random() < 0.1 else home[user]
+        address = None if rng.random() < 0.02 else f'{rng.randrange(1, 224)}.{rng.randrange(256)}.0.{user % 256}'
+        sheet.append([start + timedelta(seconds=rng.randrange(30 * 86400)), 100000 + user, f'user{user}', address,
+                      country, 'VPN Login', rng.choice(['Allowed', 'Denied']), 'Vendor', rng.randrange(1, 10)])
+    wb.save(path)
+    return path
+
+
+def make_ip_csv(path, rows=1000, duplicate_ratio=0.5, seed=0):
+    # One IP per line; duplicate_ratio of the lines repeat an IP seen earlier in the file
+    rng = random.Random(seed)
+    unique_count = max(1, int(rows * (1 - duplicate_ratio)))
+    ips = [f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}'
+           for _ in range(unique_count)]
+    lines = ips + [rng.choice(ips) for _ in range(rows - unique_count)]
+    rng.shuffle(lines)
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        for ip in lines:
+            writer.writerow([ip])
+    return path
@@ -0,0 +1,167 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory is not reported
+    resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_virustotal import FakeVirusTotal
+from fixtures import make_ip_csv, make_kri_zips, make_matrix_workbook
+
+
+# Benchmark suite for the KRI, matrix and IP checker workloads on synthetic fixtures.
+#
+# Every stage runs in a fresh process so its wall time, rows/s and peak RSS are measured in isolation.
+# Results are compared with a stored baseline (benchmarks/baseline.json by default) and stages whose
+# rows/s fall more than --tolerance below it are flagged; --save-baseline records the current run.
+#
+#     python benchmarks/run_benchmarks.py --days 30 --rows 5000
+#     python benchmarks/run_benchmarks.py --save-baseline
+
+def run_kri(zip_path1, zip_path2, **options):
+    from taskautomate.kri import process_data
+    process_data(zip_path1, zip_path2, 'November', '2023', store_path=None, **options)
+    if not os.path.exists('Result_November_2023.xlsx'):
+        raise RuntimeError("KRI run did not produce a result workbook")
+
+
+def run_matrix(input_path, **options):
+    from taskautomate.matrix import process_excel
+    process_excel(input_path, **options)
+
+
+def run_ip_checker(csv_path, api_url):
+    os.environ['VIRUSTOTAL_API_URL'] = api_url
+    from taskautomate.ipcheck import process_csv_file
+    process_csv_file(csv_path, 'benchmark-key', None, cache_path=None)  # Time the lookups, not the cache
+
+
+def stage_worker(target, kwargs, workdir, connection):
+    # Runs one stage in a child process and reports its wall time and peak RSS back to the parent
+    try:
+        os.chdir(workdir)
+        start = time.perf_counter()
+        target(**kwargs)
+        elapsed = time.perf_counter() - start
+        peak_rss = None
+        if resource is not None:
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak_rss = peak_rss if sys.platform == 'darwin' else peak_rss * 1024  # Linux reports KiB
+        connection.send({'seconds': elapsed, 'peak_rss': peak_rss})
+    except Exception as e:
+        connection.send({'error': f"{type(e).__name__}: {e}"})
+    finally:
+        connection.close()
+
+
+def run_stage(target, kwargs, workdir):
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=stage_worker, args=(target, kwargs, workdir, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': f"stage process exited with code {process.exitcode}"}
+    process.join()
+    return result
+
+
+def format_bytes(size):
+    return '-' if size is None else f'{size / (1024 * 1024):.1f} MB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the KRI, matrix and IP checker workloads")
+    parser.add_argument('--days', type=int, default=10, help="Daily sheets per KRI zip")
+    parser.add_argument('--rows', type=int, default=2000, help="Rows per KRI daily sheet")
+    parser.add_argument('--matrix-rows', type=int, default=20000, help="Rows in the matrix sheet")
+    parser.add_argument('--users', type=int, default=2000, help="Distinct users in the matrix sheet")
+    parser.add_argument('--countries', type=int, default=4, help="Distinct countries in the matrix sheet")
+    parser.add_argument('--ips', type=int, default=500, help="Lines in the IP checker CSV")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.5, help="Share of repeated IPs in the CSV")
+    parser.add_argument('--latency', type=float, default=0.0, help="Fake VirusTotal response latency (s)")
+    parser.add_argument('--stages', nargs='*', help="Only run the named stages")
+    parser.add_argument('--baseline', default=os.path.join(BENCHMARK_DIR, 'baseline.json'),
+                        help="Baseline file to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed rows/s drop against the baseline before a stage is flagged")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    results = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as workdir, FakeVirusTotal(args.latency) as fake_virustotal:
+        print("Generating fixtures...")
+        xlsx_zips = make_kri_zips(workdir, args.days, args.rows, 'xlsx')
+        csv_zips = make_kri_zips(workdir, args.days, args.rows, 'csv')
+        matrix_path = make_matrix_workbook(os.path.join(workdir, 'matrix.xlsx'), args.matrix_rows, args.users,
+                                           args.countries)
+        ip_csv_path = make_ip_csv(os.path.join(workdir, 'ips.csv'), args.ips, args.duplicate_ratio)
+
+        kri_rows = 2 * args.days * args.rows
+        stages = [
+            ('kri xlsx', run_kri, {'zip_path1': xlsx_zips[0], 'zip_path2': xlsx_zips[1]}, kri_rows),
+            ('kri xlsx streaming', run_kri,
+             {'zip_path1': xlsx_zips[0], 'zip_path2': xlsx_zips[1], 'streaming': True}, kri_rows),
+            ('kri xlsx fast reader', run_kri,
+             {'zip_path1': xlsx_zips[0], 'zip_path2': xlsx_zips[1], 'fast_xlsx': True}, kri_rows),
+            ('kri csv', run_kri, {'zip_path1': csv_zips[0], 'zip_path2': csv_zips[1]}, kri_rows),
+            ('matrix', run_matrix, {'input_path': matrix_path}, args.matrix_rows),
+            ('matrix streaming', run_matrix, {'input_path': matrix_path, 'streaming': True}, args.matrix_rows),
+            ('ip checker', run_ip_checker, {'csv_path': ip_csv_path, 'api_url': fake_virustotal.api_url},
+             args.ips),
+        ]
+
+        print(f"{'Stage':<24}{'Wall time (s)':>14}{'Rows/s':>14}{'Peak RSS':>12}{'vs baseline':>14}")
+        for name, target, kwargs, rows in stages:
+            if args.stages and name not in args.stages:
+                continue
+            result = run_stage(target, kwargs, workdir)
+            if 'error' in result:
+                print(f"{name:<24}failed: {result['error']}")
+                regressions.append(name)
+                continue
+            result['rows'] = rows
+            result['rows_per_s'] = rows / result['seconds']
+            results[name] = result
+
+            comparison = ''
+            if name in baseline:
+                change = result['rows_per_s'] / baseline[name]['rows_per_s'] - 1
+                comparison = f'{change:+.1%}'
+                if change < -args.tolerance:
+                    comparison += ' SLOWER'
+                    regressions.append(name)
+            print(f"{name:<24}{result['seconds']:>14.3f}{result['rows_per_s']:>14,.0f}"
+                  f"{format_bytes(result['peak_rss']):>12}{comparison:>14}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({**baseline, **results}, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"Regressions or failures: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from taskautomate.cli import SUBCOMMAND_MODULES
+
+
+# Measures the cold start of each taskautomate subcommand: a fresh interpreter parses the command line and
+# imports the subcommand's job module, which is everything that runs before the job itself. Also lists
+# which heavy dependencies that start pulled in, to catch eager imports creeping back.
+#
+#     python benchmarks/startup_benchmark.py --repeat 5
+
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'requests', 'tkinter')
+
+STARTUP_SCRIPT = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+from taskautomate.cli import build_parser
+build_parser()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'loaded': [name for name in sys.argv[2:] if name in sys.modules]}))
+'''
+
+
+def measure(module_name):
+    # Python's own startup is the same for every subcommand, so only the part after it is timed
+    completed = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, module_name, *HEAVY_MODULES], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of each taskautomate subcommand")
+    parser.add_argument('--repeat', type=int, default=3, help="Fresh interpreters per subcommand")
+    args = parser.parse_args()
+
+    print(f"{'Subcommand':<14}{'Startup (ms)':>14}  Heavy modules loaded")
+    for command, module_name in SUBCOMMAND_MODULES.items():
+        runs = [measure(module_name) for _ in range(args.repeat)]
+        seconds = statistics.median(run['seconds'] for run in runs)
+        print(f"{command:<14}{seconds * 1000:>14.1f}  {', '.join(runs[-1]['loaded']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+import openpyxl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taskautomate.xlsx_reader import XlsxColumnReader
+
+
+# Compares rows/s of the column-selective xlsx reader against the openpyxl paths used by the KRI scripts,
+# reading the 'message' column (L) of a synthetic Query2-style daily sheet.
+
+def build_sheet(rows):
+    wb = openpyxl.Workbook()
+    sheet = wb.active
+    sheet.append(['Event Time'] + [f'field{col}' for col in range(2, 12)] + ['message'])
+    messages = ['TCP port scan', 'SQL injection attempt', 'brute force login', 'policy allowed', None]
+    for row in range(rows):
+        sheet.append([f'2023-11-01 00:{row % 60:02d}:00'] + [f'value{row % 97}'] * 10 + [messages[row % 5]])
+    data = BytesIO()
+    wb.save(data)
+    return data.getvalue()
+
+
+def read_openpyxl(data, read_only):
+    wb = openpyxl.load_workbook(BytesIO(data), read_only=read_only, data_only=read_only)
+    count = sum(1 for _ in wb.active.iter_rows(min_row=2, max_col=12, values_only=True))
+    wb.close()
+    return count
+
+
+def read_columns(data):
+    with XlsxColumnReader(BytesIO(data)) as reader:
+        return sum(1 for _ in reader.rows([12], min_row=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark xlsx readers on a synthetic KRI sheet")
+    parser.add_argument('--rows', type=int, default=100000, help="Data rows in the synthetic sheet")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per reader; the best run is reported")
+    args = parser.parse_args()
+
+    data = build_sheet(args.rows)
+    readers = [
+        ('openpyxl', lambda: read_openpyxl(data, read_only=False)),
+        ('openpyxl read-only', lambda: read_openpyxl(data, read_only=True)),
+        ('XlsxColumnReader', lambda: read_columns(data)),
+    ]
+    print(f"{'Reader':<20}{'Best time (s)':>15}{'Rows/s':>15}")
+    for name, read in readers:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            count = read()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"{name:<20}{best:>15.3f}{count / best:>15,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# Headless cores of the KRI, matrix and IP checker tools, shared by the Tk scripts and the command line
+# (python -m taskautomate --help).
+#
+# Importing the package is cheap: pandas, openpyxl and requests are only loaded by the module of the job
+# that needs them (taskautomate.kri, taskautomate.matrix, taskautomate.ipcheck), and nothing here
+# touches tkinter.
@@ -0,0 +1,216 @@
+import argparse
+import importlib
+import os
+import sys
+from datetime import date, timedelta
+
+
+# Single command line entry point for the KRI, matrix and IP checker jobs:
+#     python -m taskautomate kri b002.zip Query2.zip November 2023 --workers 4
+#     python -m taskautomate kri-batch "KRI exports" --output Result_Q4_2023.xlsx --start 2023-10-01
+#     python -m taskautomate kri-watch drop November 2023 --interval 30
+#     python -m taskautomate matrix matrix.xlsx --formats xlsx csv
+#     python -m taskautomate ip-check ips.csv --api-key KEY
+# Only this module and the standard library are loaded to parse the arguments; each subcommand imports
+# its job module (and with it pandas, openpyxl or requests) when it runs.
+
+# Module holding the job of each subcommand, imported on demand
+SUBCOMMAND_MODULES = {
+    'kri': 'taskautomate.kri',
+    'kri-batch': 'taskautomate.kri',
+    'kri-watch': 'taskautomate.watch',
+    'matrix': 'taskautomate.matrix',
+    'ip-check': 'taskautomate.ipcheck',
+}
+
+# Same as result_writer.OUTPUT_FORMATS, repeated here so that --help does not load openpyxl
+OUTPUT_FORMATS = ('xlsx', 'csv', 'jsonl')
+# Same as lookup_engine.LOOKUP_CONCURRENCY, for the same reason (requests)
+LOOKUP_CONCURRENCY = 8
+
+
+def add_output_arguments(parser):
+    parser.add_argument('--formats', nargs='+', choices=OUTPUT_FORMATS, default=['xlsx'],
+                        help="Output formats written in the same pass")
+    parser.add_argument('--report', help="Write a JSON run report with per-stage timings to this path")
+    parser.add_argument('--prometheus', help="Also write the report's summary as a Prometheus textfile")
+
+
+def add_kri_arguments(parser, report=True):
+    parser.add_argument('--streaming', action='store_true', help="Stream daily sheets instead of loading them")
+    parser.add_argument('--fast-xlsx', action='store_true', help="Use the column-selective xlsx reader")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes parsing daily sheets")
+    parser.add_argument('--no-store', action='store_true',
+                        help="Parse every daily sheet instead of reusing results of earlier runs")
+    if report:
+        add_output_arguments(parser)
+    else:
+        parser.add_argument('--formats', nargs='+', choices=OUTPUT_FORMATS, default=['xlsx'],
+                            help="Output formats written in the same pass")
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a YYYY-MM-DD date: {value}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='taskautomate', description="Run the KRI, matrix and IP checker jobs")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    kri = subparsers.add_parser('kri', help="Count the KRI metrics of one month")
+    kri.add_argument('zip_path1', help="Zip of Query1 daily exports")
+    kri.add_argument('zip_path2', help="Zip of Query2 daily exports")
+    kri.add_argument('month', help="Month name, e.g. November")
+    kri.add_argument('year', help="Year, e.g. 2023")
+    add_kri_arguments(kri)
+
+    kri_batch = subparsers.add_parser('kri-batch', help="Count the KRI metrics of many months into one workbook")
+    kri_batch.add_argument('directory', help="Folder with one 'November 2023'-style folder per month")
+    kri_batch.add_argument('--output', default='Result_Batch.xlsx', help="Consolidated result workbook")
+    kri_batch.add_argument('--start', type=parse_date, help="First day counted (YYYY-MM-DD)")
+    kri_batch.add_argument('--end', type=parse_date, help="Last day counted (YYYY-MM-DD)")
+    add_kri_arguments(kri_batch)
+
+    kri_watch = subparsers.add_parser('kri-watch', help="Keep a month's KRI result up to date as daily sheets arrive")
+    kri_watch.add_argument('drop_dir', help="Folder with Query1 and Query2 folders of daily sheets or zips")
+    kri_watch.add_argument('month', help="Month name, e.g. November")
+    kri_watch.add_argument('year', help="Year, e.g. 2023")
+    kri_watch.add_argument('--interval', type=float, default=30.0, help="Seconds between polls")
+    add_kri_arguments(kri_watch, report=False)
+
+    matrix = subparsers.add_parser('matrix', help="Find users seen from more than one country")
+    matrix.add_argument('input_paths', nargs='+', metavar='input_path',
+                        help="Workbook with a 'matrix' sheet, or a folder of them; several are merged")
+    matrix.add_argument('--streaming', action='store_true',
+                        help="Two passes over the sheet instead of loading it, for sheets larger than memory")
+    matrix.add_argument('--travel-window', type=float, metavar='HOURS',
+                        help="Also list country changes of a user within this many hours (ImpossibleTravel sheet)")
+    matrix.add_argument('--baseline', metavar='PATH',
+                        help="Geo baseline of earlier runs to update; lists users' new countries (NewCountries sheet)")
+    matrix.add_argument('--no-cache', action='store_true',
+                        help="Parse the workbook even if it is unchanged since an earlier run")
+    matrix.add_argument('--workers', type=int, default=1, help="Worker processes loading workbooks")
+    add_output_arguments(matrix)
+
+    ip_check = subparsers.add_parser('ip-check', help="Look up the VirusTotal reputation of a CSV of IPs")
+    ip_check.add_argument('csv_file', help="CSV with one IP per line in the first column")
+    ip_check.add_argument('--api-key', action='append', metavar='KEY[:PER_MINUTE[:PER_DAY]]',
+                          help="VirusTotal API key, optionally with its quotas; repeat (or separate with commas) "
+                               "to share the lookups among several keys (default: $VIRUSTOTAL_API_KEY)")
+    ip_check.add_argument('--api-keys-file', metavar='PATH', help="File of API keys, one per line, as for --api-key")
+    ip_check.add_argument('--proxy', help="Proxy as host:port")
+    ip_check.add_argument('--output', help="Result CSV (default: output.csv next to the input)")
+    ip_check.add_argument('--concurrency', type=int, default=LOOKUP_CONCURRENCY,
+                          help="Lookups in flight at once")
+    ip_check.add_argument('--rate', type=float, metavar='PER_MINUTE',
+                          help="Most lookups per minute, to stay within the API key's quota (default: no limit)")
+    ip_check.add_argument('--cache-ttl', type=float, default=168.0, metavar='HOURS',
+                          help="Reuse cached results younger than this many hours")
+    ip_check.add_argument('--refresh', action='store_true', help="Look up every IP again and update the cache")
+    ip_check.add_argument('--no-cache', action='store_true', help="Neither read nor update the reputation cache")
+    ip_check.add_argument('--restart', action='store_true',
+                          help="Start over instead of resuming an interrupted run with the same input and output")
+    ip_check.add_argument('--expand-cidr', type=int, default=0, metavar='ADDRESSES',
+                          help="Look up the addresses of CIDR blocks of at most this many addresses")
+    ip_check.add_argument('--report', help="Write a JSON run report with per-stage timings to this path")
+    ip_check.add_argument('--prometheus', help="Also write the report's summary as a Prometheus textfile")
+    return parser
+
+
+def run_kri(kri, args):
+    kri.process_data(args.zip_path1, args.zip_path2, args.month, args.year, streaming=args.streaming,
+                     workers=args.workers, store_path=None if args.no_store else kri.RESULT_STORE_PATH,
+                     fast_xlsx=args.fast_xlsx, output_formats=tuple(args.formats), report_path=args.report,
+                     prometheus_path=args.prometheus)
+
+
+def run_kri_batch(kri, args):
+    if not os.path.isdir(args.directory):
+        sys.exit(f"Not a directory: {args.directory}")
+    jobs = kri.find_batch_jobs(args.directory)
+    if not jobs:
+        sys.exit(f"No month folders with Query1.zip and Query2.zip found in {args.directory}")
+    kri.process_batch(jobs, args.output, args.start, args.end, streaming=args.streaming, workers=args.workers,
+                      store_path=None if args.no_store else kri.RESULT_STORE_PATH, fast_xlsx=args.fast_xlsx,
+                      output_formats=tuple(args.formats), report_path=args.report,
+                      prometheus_path=args.prometheus)
+
+
+def run_kri_watch(watch, args):
+    if not os.path.isdir(args.drop_dir):
+        sys.exit(f"Not a directory: {args.drop_dir}")
+    watch.watch_folder(args.drop_dir, args.month, args.year, args.interval, args.workers,
+                       store_path=None if args.no_store else watch.RESULT_STORE_PATH, streaming=args.streaming,
+                       fast_xlsx=args.fast_xlsx, output_formats=tuple(args.formats))
+
+
+def run_matrix(matrix, args):
+    travel_window = timedelta(hours=args.travel_window) if args.travel_window is not None else None
+    output_path = matrix.process_excel(args.input_paths, tuple(args.formats), args.report, args.prometheus,
+                                       args.streaming, travel_window,
+                                       cache_dir=None if args.no_cache else matrix.PARSE_CACHE_DIR,
+                                       baseline_path=args.baseline, workers=args.workers)
+    print(f"Result saved to {output_path}.")
+
+
+def run_ip_check(ipcheck, args):
+    api_keys = ' '.join(args.api_key or [])
+    if args.api_keys_file:
+        with open(args.api_keys_file) as file:
+            api_keys += ' ' + ' '.join(line.split('#')[0] for line in file)
+    if not api_keys.strip():
+        api_keys = os.environ.get('VIRUSTOTAL_API_KEY', '')
+    if not api_keys.strip():
+        sys.exit("A VirusTotal API key is required (--api-key, --api-keys-file or $VIRUSTOTAL_API_KEY)")
+    proxy_settings = None
+    if args.proxy:
+        proxy_settings = {'http': f'http://{args.proxy}', 'https': f'https://{args.proxy}'}
+
+    report = ipcheck.RunReport('ip_checker')
+    output_path = args.output or os.path.join(os.path.dirname(args.csv_file), 'output.csv')
+    skipped_path = f'{os.path.splitext(output_path)[0]}_skipped.csv'
+    try:
+        results, skipped = ipcheck.check_csv_file(
+            args.csv_file, output_path, api_keys, proxy_settings, report=report, concurrency=args.concurrency,
+            requests_per_minute=args.rate, cache_path=None if args.no_cache else ipcheck.IP_CACHE_PATH,
+            cache_ttl=timedelta(hours=args.cache_ttl), refresh=args.refresh, expand_cidr=args.expand_cidr,
+            skipped_path=skipped_path, resume=not args.restart)
+    except (ipcheck.LookupFailed, ipcheck.NoUsableKeys) as e:
+        sys.exit(f"{e}. Run the same command again to resume.")
+    finally:
+        # Also for runs stopped early, which are the ones worth a look
+        if args.report:
+            report.save(args.report, args.prometheus)
+    if skipped:
+        print(f"Skipped lines saved to {skipped_path}.")
+    if not results:
+        print("No results found.")
+        return
+    print(f"Result saved to {output_path}.")
+
+
+SUBCOMMAND_HANDLERS = {
+    'kri': run_kri,
+    'kri-batch': run_kri_batch,
+    'kri-watch': run_kri_watch,
+    'matrix': run_matrix,
+    'ip-check': run_ip_check,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    module = importlib.import_module(SUBCOMMAND_MODULES[args.command])
+    try:
+        SUBCOMMAND_HANDLERS[args.command](module, args)
+    except KeyboardInterrupt:
+        sys.exit("Cancelled.")
+    except Exception as e:
+        sys.exit(f"An error occurred: {str(e)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import sqlite3
+
+
+# Persistent baseline of the countries each user has been seen from, kept across matrix runs so that a user
+# who has always worked from the same countries is not flagged again by every export.
+#
+# Every (user, country) pair ever seen is stored once with the time of its first and last row. Merging an
+# export widens those bounds (first_seen = min, last_seen = max), so exports can be merged in any order and
+# merging one twice changes nothing. An appearance of a country in an export is new when the user was
+# already known from another country before it, and that country was not seen for the user before it.
+# Because "before" is decided by the stored first-seen times rather than by merge order, back-filling an
+# older export flags its new countries as of their own time, and re-running an export flags the same rows.
+#
+#     with GeoBaseline('matrix_baseline.sqlite') as baseline:
+#         new_countries = baseline.merge(observations)
+#
+# Observations are (user, country, first_seen, last_seen) tuples with times as Unix seconds; users are
+# stored as text (see user_key). Both merge queries are index lookups on the (user, country) primary key
+# per observed pair, so they scale with the size of the export rather than of the baseline.
+
+MATRIX_BASELINE_PATH = 'matrix_baseline.sqlite'
+
+
+class GeoBaseline:
+    def __init__(self, path=MATRIX_BASELINE_PATH):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS user_countries ('
+            'user TEXT, country TEXT, first_seen INTEGER, last_seen INTEGER, '
+            'PRIMARY KEY (user, country)) WITHOUT ROWID')
+
+    def merge(self, observations):
+        # Add an export's (user, country, first_seen, last_seen) observations to the baseline. Returns its
+        # new country appearances as (user, country, first_seen, last_seen, known_countries) tuples, by user
+        # and first_seen, where known_countries lists the user's other countries seen before first_seen.
+        connection = self.connection
+        connection.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS seen ('
+            'user TEXT, country TEXT, first_seen INTEGER, last_seen INTEGER, '
+            'PRIMARY KEY (user, country)) WITHOUT ROWID')
+        connection.execute('DELETE FROM seen')
+        connection.executemany(
+            'INSERT INTO seen VALUES (?, ?, ?, ?) ON CONFLICT (user, country) DO UPDATE SET '
+            'first_seen = MIN(first_seen, excluded.first_seen), last_seen = MAX(last_seen, excluded.last_seen)',
+            observations)
+
+        # A user's other countries from before each observed pair, from the baseline and this export alike
+        new_countries = connection.execute(
+            'SELECT user, country, first_seen, last_seen, known FROM ('
+            '  SELECT s.*, ('
+            '    SELECT group_concat(country, \', \') FROM ('
+            '      SELECT country FROM user_countries AS b '
+            '      WHERE b.user = s.user AND b.country != s.country AND b.first_seen < s.first_seen '
+            '      UNION '
+            '      SELECT country FROM seen AS o '
+            '      WHERE o.user = s.user AND o.country != s.country AND o.first_seen < s.first_seen '
+            '      ORDER BY country)) AS known '
+            '  FROM seen AS s '
+            '  WHERE NOT EXISTS ('
+            '    SELECT 1 FROM user_countries AS b '
+            '    WHERE b.user = s.user AND b.country = s.country AND b.first_seen < s.first_seen)) '
+            'WHERE known IS NOT NULL ORDER BY user, first_seen, country').fetchall()
+
+        connection.execute(
+            'INSERT INTO user_countries SELECT * FROM seen WHERE true ON CONFLICT (user, country) DO UPDATE SET '
+            'first_seen = MIN(first_seen, excluded.first_seen), last_seen = MAX(last_seen, excluded.last_seen)')
+        connection.execute('DELETE FROM seen')
+        connection.commit()
+        return new_countries
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def user_key(user_id):
+    # Users are stored as text. pandas reads a numeric ID column holding blanks as floats, so whole-number
+    # floats are stored like the integer IDs openpyxl reads from the same cells.
+    if isinstance(user_id, float) and user_id.is_integer():
+        user_id = int(user_id)
+    return str(user_id)
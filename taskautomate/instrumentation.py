@@ -0,0 +1,131 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory is not reported
+    resource = None
+
+
+# Per-stage timing and throughput instrumentation shared by the KRI, matrix and IP checker jobs.
+#
+# A RunReport collects one entry per stage and file (unzip, parse, scan, save, HTTP lookup, ...) with
+# its duration, row count, bytes read and the process's peak RSS when the stage ended:
+#     report = RunReport('kri')
+#     with report.stage('save', file=output_path) as entry:
+#         ...
+#         entry['rows'] = row_count
+#     report.save('report.json', prometheus_path='kri.prom')
+# Timings measured elsewhere, e.g. in worker processes, are added with report.add(). Entries without a
+# file are accumulated into one entry per stage, which keeps reports small for per-row stages such as
+# HTTP lookups.
+
+def peak_rss():
+    # Peak resident set size of this process in bytes, or None where it cannot be measured
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports KiB
+
+
+class RunReport:
+    def __init__(self, job):
+        self.job = job
+        self.started = datetime.now()
+        self.start_time = time.perf_counter()
+        self.entries = []
+
+    @contextmanager
+    def stage(self, name, file=None, rows=0, bytes_read=0):
+        # Time a block of work; the yielded entry can be updated with rows and bytes_read as they become known
+        entry = {'stage': name, 'file': file, 'count': 1, 'seconds': 0.0, 'rows': rows, 'bytes_read': bytes_read}
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] = time.perf_counter() - start
+            self.add(**entry, peak_rss=peak_rss())
+
+    def add(self, stage, seconds, file=None, rows=0, bytes_read=0, peak_rss=None, count=1):
+        if file is None:
+            for entry in self.entries:
+                if entry['stage'] == stage and entry['file'] is None:
+                    entry['count'] += count
+                    entry['seconds'] += seconds
+                    entry['rows'] += rows
+                    entry['bytes_read'] += bytes_read
+                    entry['peak_rss'] = max_or_none(entry['peak_rss'], peak_rss)
+                    return
+        self.entries.append({'stage': stage, 'file': file, 'count': count, 'seconds': seconds, 'rows': rows,
+                             'bytes_read': bytes_read, 'peak_rss': peak_rss})
+
+    def summary(self):
+        # Totals per stage name, in the order stages first ran
+        totals = {}
+        for entry in self.entries:
+            total = totals.setdefault(entry['stage'], {'stage': entry['stage'], 'count': 0, 'seconds': 0.0,
+                                                       'rows': 0, 'bytes_read': 0, 'peak_rss': None})
+            total['count'] += entry['count']
+            total['seconds'] += entry['seconds']
+            total['rows'] += entry['rows']
+            total['bytes_read'] += entry['bytes_read']
+            total['peak_rss'] = max_or_none(total['peak_rss'], entry['peak_rss'])
+        return [dict(total, rows_per_s=rows_per_second(total)) for total in totals.values()]
+
+    def to_dict(self):
+        return {
+            'job': self.job,
+            'started': self.started.isoformat(timespec='seconds'),
+            'seconds': time.perf_counter() - self.start_time,
+            'peak_rss': peak_rss(),
+            'stages': self.summary(),
+            'files': [dict(entry, rows_per_s=rows_per_second(entry)) for entry in self.entries if entry['file']],
+        }
+
+    def save(self, path, prometheus_path=None):
+        report = self.to_dict()
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+        if prometheus_path:
+            write_prometheus_textfile(report, prometheus_path)
+        return report
+
+
+def write_prometheus_textfile(report, path):
+    # node_exporter textfile collector format; written to a temporary file first so the collector never
+    # reads a half-written file
+    metrics = [
+        ('tasks_automate_stage_seconds', 'Seconds spent in each stage of the last run', 'seconds'),
+        ('tasks_automate_stage_rows', 'Rows processed by each stage of the last run', 'rows'),
+        ('tasks_automate_stage_bytes_read', 'Bytes read by each stage of the last run', 'bytes_read'),
+        ('tasks_automate_stage_rows_per_second', 'Throughput of each stage of the last run', 'rows_per_s'),
+        ('tasks_automate_stage_peak_rss_bytes', 'Peak resident memory at the end of each stage', 'peak_rss'),
+    ]
+    lines = []
+    for name, help_text, key in metrics:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for stage in report['stages']:
+            if stage[key] is not None:
+                lines.append(f'{name}{{job="{report["job"]}",stage="{stage["stage"]}"}} {stage[key]}')
+    lines.append('# HELP tasks_automate_run_seconds Wall time of the last run')
+    lines.append('# TYPE tasks_automate_run_seconds gauge')
+    lines.append(f'tasks_automate_run_seconds{{job="{report["job"]}"}} {report["seconds"]}')
+
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(temporary_path, path)
+
+
+def rows_per_second(entry):
+    return entry['rows'] / entry['seconds'] if entry['seconds'] > 0 else None
+
+
+def max_or_none(first, second):
+    values = [value for value in (first, second) if value is not None]
+    return max(values) if values else None
@@ -0,0 +1,55 @@
+from datetime import timedelta
+import json
+import sqlite3
+import time
+
+
+# SQLite cache of VirusTotal lookups, so IPs that recur across daily CSVs are not looked up on every run.
+# Each IP's last_analysis_stats are stored with the time they were fetched and served for ttl afterwards.
+# get_many resolves a whole list in one query (the IPs go into a temporary table joined against the cache)
+# rather than one query per IP; failed lookups are never cached.
+#
+#     with ReputationCache('ip_reputation.sqlite', ttl=timedelta(days=7)) as cache:
+#         cached = cache.get_many(ips)  # {ip: last_analysis_stats}
+#         cache.put(ip, stats)
+
+IP_CACHE_PATH = 'ip_reputation.sqlite'
+IP_CACHE_TTL = timedelta(days=7)
+
+
+class ReputationCache:
+    def __init__(self, path=IP_CACHE_PATH, ttl=IP_CACHE_TTL):
+        self.ttl = ttl
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS ip_reputation ('
+            'ip TEXT PRIMARY KEY, stats TEXT, fetched_at REAL) WITHOUT ROWID')
+
+    def get_many(self, ips):
+        # Stats of the IPs fetched less than ttl ago, as {ip: last_analysis_stats}
+        connection = self.connection
+        connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (ip TEXT PRIMARY KEY) WITHOUT ROWID')
+        connection.execute('DELETE FROM wanted')
+        connection.executemany('INSERT OR IGNORE INTO wanted VALUES (?)', ((ip,) for ip in ips))
+        rows = connection.execute(
+            'SELECT r.ip, r.stats FROM wanted AS w JOIN ip_reputation AS r ON r.ip = w.ip WHERE r.fetched_at >= ?',
+            (time.time() - self.ttl.total_seconds(),)).fetchall()
+        connection.execute('DELETE FROM wanted')
+        return {ip: json.loads(stats) for ip, stats in rows}
+
+    def put(self, ip, stats):
+        self.connection.execute('INSERT OR REPLACE INTO ip_reputation VALUES (?, ?, ?)',
+                                (ip, json.dumps(stats), time.time()))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
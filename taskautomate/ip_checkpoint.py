@@ -0,0 +1,81 @@
+import json
+import os
+import sqlite3
+
+
+# On-disk checkpoint of an IP checker run writing its output as it goes (see ipcheck.check_csv_file).
+#
+# The checkpoint is a SQLite file next to the output. It holds the job it belongs to, the last input
+# line whose output rows have been written together with the size of the output files at that point,
+# and the result of every address looked up so far. An interrupted run restarted with the same input and
+# output therefore truncates the output files back to the checkpoint, skips the lines already written and
+# does not query the addresses looked up before it stopped again. The results live on disk rather than in
+# memory, so a run's memory stays flat however many addresses it sees. The checkpoint is deleted once the
+# run completes; a checkpoint of a different job (another input file, a changed input or other options) is
+# discarded.
+#
+#     checkpoint = RunCheckpoint('output.csv.checkpoint', job)
+#     line, state = checkpoint.position()
+#     ...
+#     checkpoint.save(line, {'offsets': [output.tell()]})
+
+# Suffix of the checkpoint file, next to the output
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+class RunCheckpoint:
+    def __init__(self, path, job):
+        # job: JSON-serializable description of the run; a checkpoint of another job is started over
+        self.path = path
+        self.job = json.dumps(job, sort_keys=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS looked_up (ip TEXT PRIMARY KEY, stats TEXT) WITHOUT ROWID')
+        if self.get('job') != self.job:
+            self.connection.execute('DELETE FROM meta')
+            self.connection.execute('DELETE FROM looked_up')
+            self.set('job', self.job)
+            self.connection.commit()
+
+    def position(self):
+        # Last line whose output is complete (0 before the first) and the state saved with it
+        position = self.get('position')
+        return tuple(json.loads(position)) if position else (0, {})
+
+    def save(self, line, state):
+        # Record that the output up to line is complete, with the JSON-serializable state (e.g. output file
+        # sizes) needed to resume from there; commits the lookups too
+        self.set('position', json.dumps([line, state]))
+        self.connection.commit()
+
+    def get_many(self, ips):
+        # Results of the addresses already looked up, as {ip: last_analysis_stats or None when it failed}
+        found = {}
+        ips = list(ips)
+        for start in range(0, len(ips), 500):  # Stay under SQLite's limit on query parameters
+            batch = ips[start:start + 500]
+            found.update((ip, json.loads(stats) if stats else None) for ip, stats in self.connection.execute(
+                f'SELECT ip, stats FROM looked_up WHERE ip IN ({", ".join("?" * len(batch))})', batch))
+        return found
+
+    def put(self, ip, stats):
+        self.connection.execute('INSERT OR REPLACE INTO looked_up VALUES (?, ?)',
+                                (ip, json.dumps(stats) if stats is not None else None))
+
+    def commit(self):
+        self.connection.commit()
+
+    def get(self, key):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def remove(self):
+        self.connection.close()
+        os.remove(self.path)
@@ -0,0 +1,79 @@
+import ipaddress
+
+
+# Preprocessing of the IP checker's CSV values before any lookup. Each value is parsed as an IPv4 or IPv6
+# address and written in canonical form (IPv6 compressed and lower case, IPv4-mapped IPv6 as IPv4), so that
+# differently written copies of an address are looked up once. Values that need no lookup are dropped with
+# one of these reasons:
+#     header           the first line is not an address
+#     blank            empty value
+#     invalid          not an address or CIDR block
+#     cidr             a CIDR block, when blocks are not expanded
+#     cidr-too-large   a CIDR block of more addresses than the expansion limit
+#     unspecified, loopback, link-local, multicast, reserved, private
+#                      not a public address, so VirusTotal has nothing on it (private also covers the
+#                      documentation and benchmarking ranges, reserved the shared address space)
+# With expand_cidr (a number of addresses), blocks up to that size are replaced by their host addresses.
+#
+#     ips, reason = normalize_ip(value, line, expand_cidr=256)
+#     # ips: canonical addresses to look up, in order; reason: None, or why the value was dropped
+
+HEADER = 'header'
+BLANK = 'blank'
+INVALID = 'invalid'
+CIDR = 'cidr'
+CIDR_TOO_LARGE = 'cidr-too-large'
+
+
+def normalize_ip(value, line, expand_cidr=0):
+    # Canonical addresses to look up for the value on a line, and None, or no addresses and the reason
+    text = value.strip()
+    if text.startswith('[') and text.endswith(']'):
+        text = text[1:-1]  # Bracketed IPv6
+    if not text:
+        return [], BLANK
+
+    if '/' in text:
+        try:
+            network = ipaddress.ip_network(text, strict=False)
+        except ValueError:
+            return [], HEADER if line == 1 else INVALID
+        reason = skip_reason(network)
+        if reason is None and not expand_cidr:
+            reason = CIDR
+        elif reason is None and network.num_addresses > expand_cidr:
+            reason = CIDR_TOO_LARGE
+        if reason is not None:
+            return [], reason
+        return [str(address) for address in network.hosts()], None
+
+    try:
+        address = ipaddress.ip_address(text)
+    except ValueError:
+        return [], HEADER if line == 1 else INVALID
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    reason = skip_reason(address)
+    if reason is not None:
+        return [], reason
+    return [str(address)], None
+
+
+def skip_reason(address):
+    # Why an address (or every address of a network) is not worth a lookup, or None for a public address.
+    # Checked from the most to the least specific range, as e.g. loopback addresses are also private.
+    if address.is_unspecified:
+        return 'unspecified'
+    if address.is_loopback:
+        return 'loopback'
+    if address.is_link_local:
+        return 'link-local'
+    if address.is_multicast:
+        return 'multicast'
+    if address.is_reserved:
+        return 'reserved'
+    if address.is_private:
+        return 'private'
+    if not address.is_global:
+        return 'reserved'
+    return None
@@ -0,0 +1,283 @@
+from collections import Counter
+import csv
+import os
+import time
+
+import requests
+
+from .instrumentation import RunReport
+from .ip_cache import IP_CACHE_PATH, IP_CACHE_TTL, ReputationCache
+from .ip_checkpoint import CHECKPOINT_SUFFIX, RunCheckpoint
+from .ip_filter import normalize_ip
+from .key_pool import NoUsableKeys
+from .lookup_engine import LOOKUP_CONCURRENCY, VIRUSTOTAL_API_URL, LookupEngine, LookupFailed, analysis_stats
+
+# CSV lines read at a time: each batch is resolved against the reputation cache in one query and its new
+# addresses are looked up concurrently before the next batch is read
+BATCH_LINES = 500
+# Lookups between commits of the checkpoint and the reputation cache within a batch, so a killed run loses
+# few of them
+COMMIT_LOOKUPS = 50
+
+RESULT_COLUMNS = ['IP', 'Malicious Count', 'Reputation']
+SKIPPED_COLUMNS = ['Line', 'Value', 'Reason']
+
+
+def check_ip_reputation(ip, api_key, proxy_settings, user_agent=None):
+    # One-off lookup of a single IP; process_csv_file uses a LookupEngine instead
+    url = f'{VIRUSTOTAL_API_URL}/ip_addresses/{ip}'
+    headers = {
+        'x-apikey': api_key
+    }
+    if user_agent:
+        headers['User-Agent'] = user_agent
+    try:
+        response = requests.get(url, headers=headers, proxies=proxy_settings, verify=False)
+        stats = analysis_stats(response)
+        return stats['malicious'] if stats is not None else None
+    except Exception as e:
+        print(f"Failed to fetch reputation for {ip}: {e}")
+    return None
+
+
+def classify_reputation(count):
+    if count is not None and count > 1:
+        return "Malicious"
+    else:
+        return "Neutral"
+
+
+def process_csv_file(csv_file, api_key, proxy_settings, progress=None, report=None, user_agent=None,
+                     concurrency=LOOKUP_CONCURRENCY, requests_per_minute=None, cache_path=IP_CACHE_PATH,
+                     cache_ttl=IP_CACHE_TTL, refresh=False, expand_cidr=0, skipped=None):
+    # api_key: one or more API keys, as 'KEY[:PER_MINUTE[:PER_DAY]]' specs separated by commas or whitespace,
+    # a list of them or a key_pool.KeyPool; the lookups are shared among the keys (see lookup_engine.LookupEngine)
+    # progress: optional callback receiving the percentage of the CSV done, e.g. to move a progress bar
+    # report: optional RunReport that receives the time spent reading the file and waiting on HTTP lookups
+    # concurrency / requests_per_minute: lookups in flight at once and the API quota to stay within (see
+    # lookup_engine.LookupEngine); results keep the order of the CSV either way
+    # cache_path / cache_ttl: reputation cache (see ip_cache.ReputationCache) consulted before any lookup, and
+    # how long its results are used; cache_path None turns it off. refresh looks up every IP again and
+    # updates the cache with the new results.
+    # expand_cidr: look up the addresses of CIDR blocks of up to this many addresses (see ip_filter.normalize_ip)
+    # skipped: optional list that receives (line, value, reason) for every value not looked up
+    # Results have one row per address of each line, with the address in canonical form. They are returned
+    # as a list; check_csv_file writes them to the output as they come instead.
+    checker = CsvChecker(api_key, proxy_settings, progress, report, user_agent, concurrency, requests_per_minute,
+                         cache_path, cache_ttl, refresh, expand_cidr)
+    results = []
+    with checker:
+        for _, result_rows, skipped_rows in checker.batches(csv_file):
+            results.extend(result_rows)
+            if skipped is not None:
+                skipped.extend(skipped_rows)
+    return results
+
+
+def check_csv_file(csv_file, output_file_path, api_key, proxy_settings, progress=None, report=None, user_agent=None,
+                   concurrency=LOOKUP_CONCURRENCY, requests_per_minute=None, cache_path=IP_CACHE_PATH,
+                   cache_ttl=IP_CACHE_TTL, refresh=False, expand_cidr=0, skipped_path=None, resume=True):
+    # Same lookups as process_csv_file, streamed: the CSV is read BATCH_LINES lines at a time and each
+    # batch's result rows are appended to output_file_path (and its skipped lines to skipped_path) before
+    # the next batch is read, so memory stays flat and finished work is on disk. A checkpoint next to the
+    # output (see ip_checkpoint.RunCheckpoint) records the lines written and every address looked up; when
+    # an interrupted run is started again with resume, it continues after the last written line and only
+    # repeats the lookups that were in flight when it stopped. A lookup that keeps failing (see
+    # lookup_engine.LookupFailed) stops the run before its batch is written, so it is retried on resume rather
+    # than missing from the output. Returns the numbers of result rows and skipped lines in the output.
+    stat = os.stat(csv_file)
+    job = {'input': os.path.abspath(csv_file), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+           'output': os.path.abspath(output_file_path),
+           'skipped': os.path.abspath(skipped_path) if skipped_path else None, 'expand_cidr': expand_cidr}
+    checkpoint_path = output_file_path + CHECKPOINT_SUFFIX
+    if not resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = RunCheckpoint(checkpoint_path, job)
+    start_line, state = checkpoint.position()
+    if start_line:
+        print(f"Resuming {csv_file} after line {start_line}.")
+    counts = state.get('counts', [0, 0])
+
+    outputs = [(output_file_path, RESULT_COLUMNS)] + ([(skipped_path, SKIPPED_COLUMNS)] if skipped_path else [])
+    files = []
+    try:
+        for index, (path, columns) in enumerate(outputs):
+            files.append(open_output(path, columns, state.get('offsets', [0, 0])[index]))
+        writers = [csv.writer(file) for file in files]
+        checker = CsvChecker(api_key, proxy_settings, progress, report, user_agent, concurrency,
+                             requests_per_minute, cache_path, cache_ttl, refresh, expand_cidr)
+        with checker:
+            for line, result_rows, skipped_rows in checker.batches(csv_file, start_line, checkpoint):
+                for index, rows in enumerate((result_rows, skipped_rows)[:len(writers)]):
+                    writers[index].writerows(rows)
+                    counts[index] += len(rows)
+                for file in files:
+                    file.flush()
+                checkpoint.save(line, {'offsets': [file.tell() for file in files], 'counts': counts})
+    except BaseException:
+        checkpoint.close()
+        raise
+    finally:
+        for file in files:
+            file.close()
+    checkpoint.remove()
+    return tuple(counts)
+
+
+def open_output(path, columns, offset):
+    # Output file to append to: started with its header row, or cut back to offset to resume a run
+    if not offset:
+        file = open(path, 'w', newline='')
+        csv.writer(file).writerow(columns)
+        return file
+    os.truncate(path, offset)
+    return open(path, 'a', newline='')
+
+
+class CsvChecker:
+    # Lookups of a CSV's IPs shared by process_csv_file and check_csv_file (see there for the options)
+    def __init__(self, api_key, proxy_settings, progress=None, report=None, user_agent=None,
+                 concurrency=LOOKUP_CONCURRENCY, requests_per_minute=None, cache_path=IP_CACHE_PATH,
+                 cache_ttl=IP_CACHE_TTL, refresh=False, expand_cidr=0):
+        self.progress = progress
+        self.report = report or RunReport('ip_checker')
+        self.cache_path = cache_path
+        self.refresh = refresh
+        self.expand_cidr = expand_cidr
+        self.cache = ReputationCache(cache_path, cache_ttl) if cache_path else None
+        self.engine = LookupEngine(api_key, proxy_settings, user_agent, concurrency, requests_per_minute)
+        # Totals printed at the end of the run: lines read, addresses resolved from the cache and looked up,
+        # and lines skipped by reason
+        self.lines = 0
+        self.targets = 0
+        self.hits = 0
+        self.looked_up = 0
+        self.reasons = Counter()
+
+    def batches(self, csv_file, start_line=0, checkpoint=None):
+        # Check the CSV after start_line, BATCH_LINES lines at a time. Yields (line, results, skipped) per batch:
+        # its last line, result rows (ip, malicious count, reputation) and skipped lines (line, value, reason).
+        # Addresses looked up earlier in the run are kept in the checkpoint, or in memory without one.
+        store = checkpoint if checkpoint is not None else MemoryStore()
+        size = os.path.getsize(csv_file) or 1
+        with open(csv_file, 'r', newline='') as file:
+            # Read through readline so that the position in the file can be told for the progress
+            reader = enumerate(csv.reader(iter(file.readline, '')), 1)
+            position = 0
+            while True:
+                start_time = time.perf_counter()
+                batch = []
+                for line, row in reader:
+                    if line > start_line:
+                        batch.append((line, row[0] if row else ''))
+                        if len(batch) == BATCH_LINES:
+                            break
+                if not batch:
+                    break
+                self.report.add('read', time.perf_counter() - start_time, rows=len(batch))
+                batch_start, position = position, file.tell()
+                result_rows, skipped_rows = self.check_batch(
+                    batch, store, lambda share: (batch_start + (position - batch_start) * share) / size * 100)
+                yield batch[-1][0], result_rows, skipped_rows
+        self.summarize()
+
+    def check_batch(self, batch, store, percent_done):
+        with self.report.stage('normalize', rows=len(batch)):
+            normalized = [(line, value, *normalize_ip(value, line, self.expand_cidr)) for line, value in batch]
+        ips = list(dict.fromkeys(ip for _, _, line_ips, _ in normalized for ip in line_ips))
+        targets = [ip for _, _, line_ips, _ in normalized for ip in line_ips]
+
+        # Addresses already looked up in this run, then the reputation cache, then VirusTotal
+        stats = store.get_many(ips)
+        cached = {}
+        if self.cache is not None and not self.refresh:
+            with self.report.stage('cache lookup', file=self.cache_path, rows=len(ips)):
+                cached = self.cache.get_many([ip for ip in ips if ip not in stats])
+            stats.update(cached)
+        pending = [ip for ip in ips if ip not in stats]
+        for i, (ip, (ip_stats, seconds)) in enumerate(zip(pending, self.engine.map(pending))):
+            self.report.add('lookup', seconds, rows=1)
+            stats[ip] = ip_stats
+            if ip_stats is not None:
+                # Only answered lookups are kept, so anything else is looked up again after a resume
+                store.put(ip, ip_stats)
+                if self.cache is not None:
+                    self.cache.put(ip, ip_stats)
+            if (i + 1) % COMMIT_LOOKUPS == 0:
+                store.commit()
+                if self.cache is not None:
+                    self.cache.commit()
+            if self.progress is not None:
+                self.progress(percent_done((i + 1) / (len(pending) + 1)))
+        if self.cache is not None:
+            self.cache.commit()
+            hits = sum(ip in cached for ip in targets)
+            self.report.add('cache hit', 0.0, rows=hits)
+            self.report.add('cache miss', 0.0, rows=len(targets) - hits)
+            self.hits += hits
+        if self.progress is not None:
+            self.progress(percent_done(1))
+
+        results = []
+        skipped = []
+        for line, value, line_ips, reason in normalized:
+            if reason is not None:
+                skipped.append((line, value, reason))
+            for ip in line_ips:
+                if stats[ip] is not None:
+                    malicious_count = stats[ip]['malicious']
+                    results.append((ip, malicious_count, classify_reputation(malicious_count)))
+        if skipped:
+            self.report.add('skipped', 0.0, rows=len(skipped))
+            self.reasons.update(reason for _, _, reason in skipped)
+        self.lines += len(batch)
+        self.targets += len(targets)
+        self.looked_up += len(pending)
+        return results, skipped
+
+    def summarize(self):
+        if self.reasons:
+            print(f"Skipped {sum(self.reasons.values())} of {self.lines} lines: "
+                  f"{', '.join(f'{count} {reason}' for reason, count in self.reasons.most_common())}.")
+        if self.cache is not None:
+            if self.refresh:
+                print(f"Refreshed the reputation cache: {self.looked_up} IPs looked up.")
+            else:
+                print(f"{self.hits} of {self.targets} IPs found in the reputation cache, {self.looked_up} looked up.")
+        if self.engine.throttled:
+            self.report.add('throttled', self.engine.throttled_seconds, rows=self.engine.throttled)
+
+    def summarize_keys(self):
+        # Usage of each API key of a pool, also when the run ends early (e.g. once no key can be used)
+        keys = self.engine.keys.stats()
+        if len(keys) > 1:
+            print("API key usage:")
+            for key in keys:
+                self.report.add(f"api key {key['key']}", key['parked_seconds'], rows=key['requests'])
+                print(f"  {key['key']}: {key['requests']} requests, {key['throttled']} throttled "
+                      f"({key['parked_seconds']:.1f}s parked){', rejected' if key['rejected'] else ''}")
+
+    def close(self):
+        self.engine.close()
+        self.summarize_keys()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MemoryStore(dict):
+    # In-memory stand-in for RunCheckpoint's store of the addresses looked up in a run
+    def get_many(self, ips):
+        return {ip: self[ip] for ip in ips if ip in self}
+
+    def put(self, ip, stats):
+        self[ip] = stats
+
+    def commit(self):
+        pass
+
@@ -0,0 +1,174 @@
+from datetime import datetime, timezone
+import re
+import threading
+import time
+
+
+# Rate limiting for VirusTotal lookups: token buckets, and a pool of API keys sharing the lookups.
+#
+# Each key may have its own quota, given as 'KEY', 'KEY:PER_MINUTE' or 'KEY:PER_MINUTE:PER_DAY' (keys are
+# hexadecimal, so ':' never appears in one). Every lookup takes a key from the pool: among the keys with a
+# request left this minute, the one with the most requests left today (the least used one on a tie), so
+# keys are used in proportion to their quotas and the pool's throughput approaches their sum. A key
+# answering HTTP 429 is parked until its Retry-After (or a backoff) has passed while the other keys carry
+# on; a key answering HTTP 401 is rejected and not used again in the run. Daily quotas count the requests
+# of this run and reset at midnight UTC, like VirusTotal's. When no key can be used any more today, acquire
+# raises NoUsableKeys.
+#
+#     pool = KeyPool.from_specs(parse_key_specs('KEY1:4:500, KEY2:1000'))
+#     key = pool.acquire()
+#     response = session.get(url, headers={'x-apikey': key.api_key})
+
+
+class NoUsableKeys(Exception):
+    pass
+
+
+class TokenBucket:
+    # Thread-safe token bucket refilled at rate tokens per second up to capacity; rate None never blocks
+    def __init__(self, rate=None, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Take one token, sleeping until one is available
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self):
+        # Take one token if one is available now and return 0, or return the seconds until one will be
+        with self.lock:
+            wait = self.wait()
+            if wait <= 0 and self.rate is not None:
+                self.tokens -= 1
+            return wait
+
+    def wait(self):
+        # Seconds until a token is available (0 when one is); call with the lock held
+        if self.rate is None:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class ApiKey:
+    def __init__(self, api_key, per_minute=None, per_day=None):
+        self.api_key = api_key
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.bucket = TokenBucket(per_minute / 60 if per_minute else None, per_minute)
+        self.day = utc_day()
+        self.used_today = 0
+        self.parked_until = 0.0
+        self.rejected = False
+        # Consecutive HTTP 429 answers, for the backoff when the server sends no Retry-After
+        self.throttled_in_a_row = 0
+        # Usage of the run: requests sent, HTTP 429 answers and seconds parked for them
+        self.requests = 0
+        self.throttled = 0
+        self.parked_seconds = 0.0
+
+    @property
+    def label(self):
+        # The key as shown in messages and reports, with most of it masked
+        return f'{self.api_key[:4]}...{self.api_key[-4:]}' if len(self.api_key) > 12 else f'{self.api_key[:2]}...'
+
+    def left_today(self):
+        if self.day != utc_day():
+            self.day = utc_day()
+            self.used_today = 0
+        return self.per_day - self.used_today if self.per_day else float('inf')
+
+
+class KeyPool:
+    def __init__(self, keys):
+        if not keys:
+            raise ValueError("No API key given")
+        self.keys = keys
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_specs(cls, specs):
+        # Pool of keys given as 'KEY[:PER_MINUTE[:PER_DAY]]' specs (see parse_key_specs)
+        keys = []
+        for spec in specs:
+            api_key, *quotas = spec.split(':')
+            if len(quotas) > 2:
+                raise ValueError(f"Invalid API key spec: {spec}")
+            try:
+                per_minute, per_day = (float(quota) if quota else None for quota in quotas + [''] * (2 - len(quotas)))
+            except ValueError:
+                raise ValueError(f"Invalid quota in API key spec: {spec}")
+            keys.append(ApiKey(api_key, per_minute, int(per_day) if per_day else None))
+        return cls(keys)
+
+    def acquire(self):
+        # Key to send the next request with, waiting until one has a request left
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                ready = []
+                waits = []
+                for key in self.keys:
+                    if key.rejected or key.left_today() <= 0:
+                        continue
+                    if key.parked_until > now:
+                        waits.append(key.parked_until - now)
+                        continue
+                    with key.bucket.lock:
+                        wait = key.bucket.wait()
+                    if wait > 0:
+                        waits.append(wait)
+                    else:
+                        ready.append(key)
+                if ready:
+                    key = max(ready, key=lambda key: (key.left_today(), -key.requests))
+                    key.bucket.try_acquire()
+                    key.requests += 1
+                    key.used_today += 1
+                    return key
+                if not waits:
+                    raise NoUsableKeys("No API key can be used: every key was rejected or has used its daily quota")
+            time.sleep(min(waits))
+
+    def park(self, key, seconds):
+        # Leave a throttled key unused for seconds
+        with self.lock:
+            key.parked_until = max(key.parked_until, time.monotonic() + seconds)
+            key.throttled += 1
+            key.throttled_in_a_row += 1
+            key.parked_seconds += seconds
+
+    def succeeded(self, key):
+        with self.lock:
+            key.throttled_in_a_row = 0
+
+    def reject(self, key):
+        # Stop using a key the server refused (HTTP 401)
+        with self.lock:
+            if not key.rejected:
+                key.rejected = True
+                print(f"API key {key.label} was rejected (HTTP 401) and is no longer used.")
+
+    def stats(self):
+        # Usage of each key in the run
+        return [{'key': key.label, 'requests': key.requests, 'throttled': key.throttled,
+                 'parked_seconds': key.parked_seconds, 'rejected': key.rejected} for key in self.keys]
+
+
+def parse_key_specs(text):
+    # API key specs separated by commas, semicolons or whitespace, e.g. from the GUI's API key box
+    return [spec for spec in re.split(r'[\s,;]+', text) if spec]
+
+
+def utc_day():
+    return datetime.now(timezone.utc).date()
+
@@ -0,0 +1,637 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO, TextIOWrapper
+import csv
+import gzip
+import hashlib
+import json
+import multiprocessing
+import sqlite3
+import zipfile
+import os
+import re
+import time
+
+import openpyxl
+
+from .instrumentation import RunReport, peak_rss
+from .result_writer import ResultWriter
+from .xlsx_reader import XlsxColumnReader
+
+
+# Declarative KRI metric definitions. Each metric counts the rows of every daily sheet in one of the
+# input zips ('source': 1 for zip_path1, 2 for zip_path2) that satisfy a match rule, and lands as one
+# column of a result sheet:
+#   'sheet'  - title of the result sheet the metric is written to
+#   'header' - column header in that result sheet
+#   'column' - header name of the column to test, or its 1-based index when sheets have no usable header
+#   'match'  - 'count' (every row), 'equals' (cell == value) or 'contains_any' (case-insensitive substring
+#              of any word in value)
+#   'keyword_sheet' - optional, for 'contains_any': also write per-keyword hit counts per day to this sheet
+# All metrics reading the same zip are evaluated together in a single pass over each sheet, so adding
+# a KRI costs no extra parse. If a named column is missing from a sheet the metric is skipped for that day.
+KRI_METRICS = [
+    # Query1: sheets with 'deviceAction' column
+    {'source': 1, 'sheet': 'Query1', 'header': 'Blocked Count',
+     'column': 'deviceAction', 'match': 'equals', 'value': 'blocked'},
+    # Query2: sheets with 'Event Time' (column A) and 'message' (column L) columns
+    {'source': 2, 'sheet': 'Query2', 'header': 'Total Event Time Count',
+     'column': 1, 'match': 'count'},
+    {'source': 2, 'sheet': 'Query2', 'header': 'Filtered Message Count',
+     'column': 12, 'match': 'contains_any', 'value': ['tcp', 'sql injection', 'brute force'],
+     'keyword_sheet': 'Query2 Keywords'},
+]
+
+
+# Daily sheet formats accepted inside the zips. CSV exports parse far faster than xlsx and are counted
+# with the same header lookup and metric rules.
+MEMBER_EXTENSIONS = ('.xlsx', '.csv', '.csv.gz')
+
+# Per-day results of earlier runs are kept here, next to the result workbook, so re-runs only parse new
+# or changed daily sheets. Pass store_path=None to process_data to always parse everything.
+RESULT_STORE_PATH = 'KRI_results.sqlite'
+
+# A cancelled run stops scanning within this many rows of the sheet being read
+CANCEL_CHECK_ROWS = 1000
+
+# Bytes read and discarded at a time when streaming mode seeks forward in a zip member
+STREAM_SEEK_READ = 64 * 1024
+
+
+class ProcessingCancelled(Exception):
+    pass
+
+
+def process_data(zip_path1, zip_path2, month, year, streaming=False, workers=1, metrics=None,
+                 store_path=RESULT_STORE_PATH, fast_xlsx=False, output_formats=('xlsx',), report_path=None,
+                 prometheus_path=None, progress=None, cancel_event=None):
+    # report_path / prometheus_path: optional JSON run report and Prometheus textfile with per-file and
+    # per-stage timings (see instrumentation.RunReport)
+    # progress / cancel_event: optional callback receiving progress events and threading.Event that stops
+    # the run (see ProgressTracker). A cancelled run raises ProcessingCancelled; errors are raised as well.
+    metrics = metrics or KRI_METRICS
+    zip_paths = {1: zip_path1, 2: zip_path2}
+    report = RunReport('kri')
+    tracker = ProgressTracker(progress, cancel_event)
+
+    # One pool of worker processes is shared by every zip; workers=1 keeps everything in-process
+    executor = tracker.create_executor(workers)
+    store = ResultStore(store_path) if store_path else None
+    try:
+        metric_counts, keyword_counts = process_month(zip_paths, month, year, metrics, streaming, executor, store,
+                                                      fast_xlsx=fast_xlsx, report=report, tracker=tracker)
+    finally:
+        tracker.shutdown(executor)
+        if store is not None:
+            store.close()
+
+    # Write one result sheet per target sheet, in the order the metrics are defined, to the result workbook
+    # (and CSV / JSON Lines copies when requested)
+    output_path = f'Result_{month}_{year}.xlsx'
+    with report.stage('save', file=output_path):
+        with ResultWriter(output_path, output_formats) as result_wb:
+            write_result_sheets(result_wb, metrics, metric_counts, keyword_counts)
+
+    if report_path:
+        report.save(report_path, prometheus_path)
+
+    print("Processing completed. Result saved.")
+    return output_path
+
+
+def process_batch(jobs, output_path='Result_Batch.xlsx', start=None, end=None, streaming=False, workers=1,
+                  metrics=None, store_path=RESULT_STORE_PATH, fast_xlsx=False, output_formats=('xlsx',),
+                  report_path=None, prometheus_path=None, progress=None, cancel_event=None):
+    # Process many months in one run. jobs is a list of (zip_path1, zip_path2, month, year) tuples, e.g. from
+    # find_batch_jobs(). Only days between the start and end dates (inclusive, either may be None) are
+    # counted. The consolidated workbook gets the usual result sheets per month, suffixed with the month,
+    # plus a Summary sheet with each month's totals.
+    metrics = metrics or KRI_METRICS
+    report = RunReport('kri_batch')
+    tracker = ProgressTracker(progress, cancel_event)
+
+    # Create a new workbook to store the result, starting with the summary sheet
+    with ResultWriter(output_path, output_formats) as result_wb:
+        summary_sheet = result_wb.create_sheet('Summary')
+        summary_sheet.append(['Month'] + [metric['header'] for metric in metrics])
+        month_totals = []
+
+        # One pool of worker processes and one result store are shared by every month in the batch
+        executor = tracker.create_executor(workers)
+        store = ResultStore(store_path) if store_path else None
+        try:
+            for zip_path1, zip_path2, month, year in sorted(jobs, key=lambda job: month_start(job[2], job[3])):
+                if (end is not None and month_start(month, year) > end or
+                        start is not None and month_start(month, year, last_day=True) < start):
+                    continue
+                metric_counts, keyword_counts = process_month({1: zip_path1, 2: zip_path2}, month, year,
+                                                              metrics, streaming, executor, store, start, end,
+                                                              fast_xlsx, report, tracker)
+
+                # Write this month's result sheets, e.g. 'Query1 Nov 2023'
+                write_result_sheets(result_wb, metrics, metric_counts, keyword_counts, f' {month[:3]} {year}')
+                month_totals.append([f'{month} {year}'] + [sum(counts.values()) for counts in metric_counts])
+        finally:
+            tracker.shutdown(executor)
+            if store is not None:
+                store.close()
+
+        # Roll the monthly totals up into the summary sheet
+        for row in month_totals:
+            summary_sheet.append(row)
+        summary_sheet.append(['Total'] + [sum(row[column] for row in month_totals)
+                                          for column in range(1, len(metrics) + 1)])
+
+    if report_path:
+        report.save(report_path, prometheus_path)
+
+    print(f"Processing completed. Result saved to {output_path}.")
+    return output_path
+
+
+def find_batch_jobs(directory):
+    # Discover batch jobs in a directory laid out as one folder per month, named like 'November 2023' or
+    # 'November_2023', each holding that month's Query1.zip and Query2.zip
+    jobs = []
+    for folder in sorted(os.listdir(directory)):
+        month, _, year = folder.replace('_', ' ').partition(' ')
+        zip_path1 = os.path.join(directory, folder, 'Query1.zip')
+        zip_path2 = os.path.join(directory, folder, 'Query2.zip')
+        try:
+            month_start(month, year)
+        except ValueError:
+            continue
+        if os.path.isfile(zip_path1) and os.path.isfile(zip_path2):
+            jobs.append((zip_path1, zip_path2, month, year))
+        else:
+            print(f"Missing Query1.zip or Query2.zip in folder: {folder}")
+    return jobs
+
+
+def month_start(month, year, last_day=False):
+    # First (or last) date of a month given by name, e.g. ('November', '2023')
+    date = datetime.strptime(f"{month} 1, {year}", "%B %d, %Y").date()
+    if last_day:
+        date = date.replace(year=date.year + date.month // 12, month=date.month % 12 + 1) - timedelta(days=1)
+    return date
+
+
+def process_month(zip_paths, month, year, metrics, streaming=False, executor=None, store=None, start=None,
+                  end=None, fast_xlsx=False, report=None, tracker=None):
+    # Scan each zip once, evaluating all of the metrics that read from it.
+    # zip_paths maps each metric 'source' to its zip file.
+    report = report or RunReport('kri')
+    tracker = tracker or ProgressTracker()
+    metric_counts = [{} for _ in metrics]
+    keyword_counts = [{} for _ in metrics]
+
+    # List the daily sheets of every zip first, so progress starts out with the month's file total
+    zip_members = {}
+    for zip_path in dict.fromkeys(zip_paths[metric['source']] for metric in metrics):
+        with report.stage('list members', file=zip_path):
+            zip_members[zip_path] = [(date, info) for date, info in dated_members(zip_path, month, year)
+                                     if (start is None or date >= start) and (end is None or date <= end)]
+    tracker.add_files(sum(len(members) for members in zip_members.values()))
+
+    for zip_path, members in zip_members.items():
+        tracker.check()
+        slots = [slot for slot, metric in enumerate(metrics) if zip_paths[metric['source']] == zip_path]
+        zip_counts, zip_keyword_counts = process_zip(zip_path, members, [metrics[slot] for slot in slots], streaming,
+                                                     executor, store, fast_xlsx, report, tracker)
+        for slot, counts, keywords in zip(slots, zip_counts, zip_keyword_counts):
+            metric_counts[slot] = counts
+            keyword_counts[slot] = keywords
+    return metric_counts, keyword_counts
+
+
+def load_workbook_from_zip(zip_ref, file_name):
+    # Default mode: decompress the whole member into memory and build the full cell object graph
+    with zip_ref.open(file_name) as sheet_file:
+        return openpyxl.load_workbook(BytesIO(sheet_file.read()))
+
+
+@contextmanager
+def open_member_rows(zip_ref, file_name, streaming=False, fast_xlsx=False):
+    # Open a daily sheet (xlsx, csv or gzip'd csv) and yield its header row plus a function returning an
+    # iterator over the remaining rows, all as tuples of cell values. The function takes the 1-based
+    # column indices the caller needs; readers may leave the other columns as None.
+    if file_name.endswith('.xlsx') and (fast_xlsx or streaming):
+        # Column-selective reader: only the needed columns of each row are decoded.
+        #
+        # Streaming mode reads the member straight from the zip stream, one row at a time, and discards
+        # each row once counted. Shared strings are looked up in a temporary on-disk table (see
+        # xlsx_reader.SharedStrings) rather than held in memory, so peak memory per member does not grow
+        # with the number of rows or of distinct strings: about 5 MB for a sheet of 40k or of 160k rows
+        # with a distinct message on every row. openpyxl cannot give such a ceiling even read-only, as it
+        # loads the whole shared-strings table and keeps an element for every row parsed.
+        if streaming:
+            member = zip_ref.open(file_name)
+            # Seeking forward in a zip stream reads and discards up to 16 MB at a time by default
+            member.MAX_SEEK_READ = STREAM_SEEK_READ
+        else:
+            with zip_ref.open(file_name) as sheet_file:
+                member = BytesIO(sheet_file.read())
+        with member, XlsxColumnReader(member) as reader:
+            yield reader.header(), lambda columns: reader.rows(columns, min_row=2)
+    elif file_name.endswith('.xlsx'):
+        wb = load_workbook_from_zip(zip_ref, file_name)
+        try:
+            sheet = wb.active
+            header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+            yield header, lambda columns: sheet.iter_rows(min_row=2, max_col=max(columns), values_only=True)
+        finally:
+            wb.close()
+    else:
+        # CSV is always streamed straight from the zip, decompressing the gzip layer on the fly
+        with zip_ref.open(file_name) as member:
+            raw = gzip.open(member) if file_name.endswith('.gz') else member
+            with TextIOWrapper(raw, encoding='utf-8-sig', errors='replace', newline='') as text:
+                reader = csv.reader(text)
+                header = tuple(next(reader, ()))
+                yield header, lambda columns: (csv_row_values(row) for row in reader)
+
+
+def csv_row_values(row):
+    # Empty CSV fields read as None, the same as empty cells in an xlsx sheet
+    return tuple(value if value != '' else None for value in row)
+
+
+def cell_value(row, col_index):
+    # Read-only rows are not padded out to max_col when trailing cells are empty
+    return row[col_index - 1] if len(row) >= col_index else None
+
+
+def dated_members(zip_path, month, year):
+    # List the daily sheets in the zip together with the date parsed from each file name
+    members = []
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for file_name in zip_ref.namelist():
+            date = member_date(file_name, month, year)
+            if date is not None:
+                members.append((date, zip_ref.getinfo(file_name)))
+    return members
+
+
+def member_date(file_name, month, year):
+    # Date of a daily sheet named by day of month, e.g. '05.xlsx', or None for files that are not daily sheets
+    extension = next((ext for ext in MEMBER_EXTENSIONS if file_name.endswith(ext)), None)
+    if not extension:
+        return None
+    date_str = os.path.basename(file_name)[:-len(extension)]
+
+    # Parse date string to datetime object
+    try:
+        return datetime.strptime(f"{month} {date_str}, {year}", "%B %d, %Y").date()
+    except ValueError:
+        print(f"Invalid date format for file: {file_name}")
+        return None
+
+
+class FolderArchive:
+    # Loose daily sheets in a folder, opened by name like the members of a zip
+    def __init__(self, path):
+        self.path = path
+
+    def open(self, file_name):
+        return open(os.path.join(self.path, file_name), 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+def open_archive(path):
+    # Daily sheets are read from a zip, or straight from a folder of loose files
+    return FolderArchive(path) if os.path.isdir(path) else zipfile.ZipFile(path, 'r')
+
+
+class ProgressTracker:
+    # Progress and cancellation of a run. After the daily sheets are listed and after each one is done,
+    # callback (if any) receives a dict with 'files_done', 'files_total', 'rows' (rows scanned so far),
+    # 'elapsed' and 'eta' (seconds; eta is None until a sheet is done), 'rows_per_second' and 'member' (the
+    # sheet just done, None when listing). In batch runs files_total grows as each month is listed. The
+    # callback runs on the thread running the job, so GUIs should hand events to their main loop, e.g.
+    # through queue.Queue.put.
+    #
+    # Once cancel_event is set, sheets not yet started are dropped, sheets being scanned stop within
+    # CANCEL_CHECK_ROWS rows (in worker processes too) and the run raises ProcessingCancelled.
+
+    def __init__(self, callback=None, cancel_event=None):
+        self.callback = callback
+        self.cancel_event = cancel_event
+        # Worker processes cannot see a threading.Event, so a cancel request is relayed to them through this one
+        self.worker_event = None
+        self.files_total = 0
+        self.files_done = 0
+        self.rows = 0
+        self.start_time = time.perf_counter()
+
+    def create_executor(self, workers):
+        # Process pool for the run, or None to scan in-process when workers <= 1
+        if workers <= 1:
+            return None
+        if self.cancel_event is not None:
+            self.worker_event = multiprocessing.Event()
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self.worker_event,))
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def check(self):
+        if self.cancelled():
+            if self.worker_event is not None:
+                self.worker_event.set()
+            raise ProcessingCancelled("Processing cancelled.")
+
+    def shutdown(self, executor):
+        # A cancelled run returns without waiting for workers still loading a sheet (openpyxl cannot be
+        # interrupted mid-load); they drop it and exit in the background
+        if executor is not None:
+            executor.shutdown(wait=not self.cancelled(), cancel_futures=True)
+
+    def add_files(self, count):
+        self.files_total += count
+        self.notify(None)
+
+    def file_done(self, member, rows=0):
+        self.files_done += 1
+        self.rows += rows
+        self.notify(member)
+
+    def notify(self, member):
+        if self.callback is None:
+            return
+        elapsed = time.perf_counter() - self.start_time
+        eta = None
+        if self.files_done:
+            eta = elapsed / self.files_done * (self.files_total - self.files_done)
+        self.callback({'files_done': self.files_done, 'files_total': self.files_total, 'rows': self.rows,
+                       'elapsed': elapsed, 'eta': eta, 'rows_per_second': self.rows / elapsed if elapsed else 0.0,
+                       'member': member})
+
+
+# Cancel event of the run a pool worker process belongs to, handed over by init_worker
+worker_cancel_event = None
+
+
+def init_worker(cancel_event):
+    global worker_cancel_event
+    worker_cancel_event = cancel_event
+
+
+class ResultStore:
+    # SQLite store of per-day scan results. A result is keyed by the zip member's name, its CRC-32 and
+    # size from the zip directory (so no decompression is needed to spot a changed sheet) and a hash of
+    # the metric rules it was computed with (so editing KRI_METRICS never serves stale counts).
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS member_results ('
+            'member TEXT, crc INTEGER, size INTEGER, metrics TEXT, result TEXT, '
+            'PRIMARY KEY (member, crc, size, metrics))')
+
+    @staticmethod
+    def signature(metrics):
+        return hashlib.sha1(json.dumps(metrics, sort_keys=True).encode()).hexdigest()
+
+    def get(self, info, signature):
+        row = self.connection.execute(
+            'SELECT result FROM member_results WHERE member = ? AND crc = ? AND size = ? AND metrics = ?',
+            (info.filename, info.CRC, info.file_size, signature)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, info, signature, result):
+        self.connection.execute('INSERT OR REPLACE INTO member_results VALUES (?, ?, ?, ?, ?)',
+                                (info.filename, info.CRC, info.file_size, signature, json.dumps(result)))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def resolve_column(header, column):
+    # Map a metric's column (header name or 1-based index) to a 1-based index, or None if not present
+    if isinstance(column, str):
+        for col_index, value in enumerate(header, 1):
+            if value == column:
+                return col_index
+        return None
+    return column
+
+
+def trie_regex(words):
+    # Build a regex matching any of the words, shaped like a trie so shared prefixes are tested only once
+    # ('sql injection' and 'sql error' become 'sql (?:error|injection)'). Greedy optional suffixes make
+    # the regex prefer the longest word at each position.
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def node_regex(node):
+        branches = [re.escape(char) + node_regex(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return node_regex(trie)
+
+
+class KeywordMatcher:
+    # Case-insensitive multi-keyword matcher. All keywords are compiled into one trie-shaped regex, so a
+    # message is scanned once no matter how many keywords there are, without lowercasing a copy per row.
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(word.lower() for word in keywords if word))
+        regex = trie_regex(self.keywords) if self.keywords else '(?!)'
+        self.search_pattern = re.compile(regex, re.IGNORECASE)
+        # Zero-width lookahead so the longest keyword starting at every position is reported
+        self.scan_pattern = re.compile(f'(?=({regex}))', re.IGNORECASE)
+        # Keywords contained in each keyword, so overlapping hits ('sql' inside 'sql injection') count too
+        self.contained = {word: [other for other in self.keywords if other in word] for word in self.keywords}
+
+    def matches(self, text):
+        return self.search_pattern.search(text) is not None
+
+    def keywords_in(self, text):
+        found = set()
+        for match in self.scan_pattern.finditer(text):
+            found.update(self.contained.get(match.group(1).lower(), ()))
+        return found
+
+
+def compile_metric(metric):
+    # Build the row predicate for a metric's match rule
+    match = metric['match']
+    if match == 'count':
+        return lambda value: True
+    if match == 'equals':
+        target = metric['value']
+        return lambda value: value == target
+    if match == 'contains_any':
+        matcher = KeywordMatcher(metric['value'])
+        return lambda value: matcher.matches(str(value))
+    raise ValueError(f"Unknown match type for metric {metric['header']}: {match}")
+
+
+def scan_member(zip_path, file_name, metrics, streaming=False, fast_xlsx=False, cancel_event=None):
+    # Runs in a worker process: every worker opens its own handle on the zip file (or folder, see open_archive).
+    # Returns one count per metric (None where the metric's column is missing from the sheet), for
+    # metrics with a keyword_sheet the per-keyword hit counts ({} for the others), and timing stats.
+    # Raises ProcessingCancelled once cancel_event (or the pool's, in a worker process) is set.
+    cancel_event = cancel_event or worker_cancel_event
+    if cancel_event is not None and cancel_event.is_set():
+        raise ProcessingCancelled("Processing cancelled.")
+    stats = {'open_seconds': 0.0, 'scan_seconds': 0.0, 'rows': 0, 'peak_rss': None}
+    start_time = time.perf_counter()
+    with open_archive(zip_path) as zip_ref:
+        # Read the daily sheet from the zip file
+        with open_member_rows(zip_ref, file_name, streaming, fast_xlsx) as (header, read_rows):
+            stats['open_seconds'] = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+
+            # Resolve named columns from the header row only
+            counts = [None] * len(metrics)
+            keyword_counts = [{} for _ in metrics]
+            rules = []
+            keyword_rules = []
+            for slot, metric in enumerate(metrics):
+                col_index = 1 if metric['match'] == 'count' else resolve_column(header, metric['column'])
+                if col_index is None:
+                    continue
+                counts[slot] = 0
+                if metric['match'] == 'contains_any' and metric.get('keyword_sheet'):
+                    matcher = KeywordMatcher(metric['value'])
+                    keyword_counts[slot] = dict.fromkeys(matcher.keywords, 0)
+                    keyword_rules.append((slot, col_index, matcher))
+                else:
+                    rules.append((slot, col_index, compile_metric(metric)))
+
+            if not rules and not keyword_rules:
+                return counts, keyword_counts, stats
+
+            # Evaluate every metric against each row in a single pass
+            columns = {col_index for _, col_index, _ in rules + keyword_rules}
+            for stats['rows'], row in enumerate(read_rows(columns), 1):
+                if stats['rows'] % CANCEL_CHECK_ROWS == 0 and cancel_event is not None and cancel_event.is_set():
+                    raise ProcessingCancelled("Processing cancelled.")
+                for slot, col_index, matches in rules:
+                    if matches(cell_value(row, col_index)):
+                        counts[slot] += 1
+                for slot, col_index, matcher in keyword_rules:
+                    found = matcher.keywords_in(str(cell_value(row, col_index)))
+                    if found:
+                        counts[slot] += 1
+                        for word in found:
+                            keyword_counts[slot][word] += 1
+            stats['scan_seconds'] = time.perf_counter() - start_time
+            stats['peak_rss'] = peak_rss()
+            return counts, keyword_counts, stats
+
+
+def process_zip(zip_path, members, metrics, streaming=False, executor=None, store=None, fast_xlsx=False,
+                report=None, tracker=None):
+    # Scan the zip's daily sheets (members, as listed by dated_members), fanning out to the process pool
+    # when one is given. Each day is independent, so per-day counts are simply collected back into one
+    # {date: count} dictionary per metric, plus one {date: {keyword: count}} dictionary per metric.
+    report = report or RunReport('kri')
+    tracker = tracker or ProgressTracker()
+
+    # Reuse stored results for daily sheets that have not changed since an earlier run
+    results = [None] * len(members)
+    signature = ResultStore.signature(metrics) if store is not None else None
+    if store is not None:
+        with report.stage('store lookup') as entry:
+            results = [store.get(info, signature) for _, info in members]
+            entry['rows'] = sum(1 for result in results if result is not None)
+        for (_, info), result in zip(members, results):
+            if result is not None:
+                tracker.file_done(f'{os.path.basename(zip_path)}/{info.filename}')
+    pending = [index for index, result in enumerate(results) if result is None]
+
+    def collect(index, scanned):
+        counts, keywords, stats = scanned
+        info = members[index][1]
+        results[index] = counts, keywords
+        if store is not None:
+            store.put(info, signature, results[index])
+
+        # Unzipping and loading a member is timed as 'open'; the row pass (which also parses rows lazily
+        # in streaming, fast-reader and CSV modes) as 'scan'
+        member = f'{zip_path}:{info.filename}'
+        report.add('open', stats['open_seconds'], file=member, bytes_read=info.compress_size,
+                   peak_rss=stats['peak_rss'])
+        report.add('scan', stats['scan_seconds'], file=member, rows=stats['rows'], peak_rss=stats['peak_rss'])
+        tracker.file_done(f'{os.path.basename(zip_path)}/{info.filename}', stats['rows'])
+
+    # Results finished before a failure or cancel request are still stored, so a re-run picks up from there
+    try:
+        if executor is None:
+            for index in pending:
+                tracker.check()
+                collect(index, scan_member(zip_path, members[index][1].filename, metrics, streaming, fast_xlsx,
+                                           tracker.cancel_event))
+        else:
+            futures = {executor.submit(scan_member, zip_path, members[index][1].filename, metrics, streaming,
+                                       fast_xlsx): index for index in pending}
+            while futures:
+                # Wake up regularly to notice a cancel request while every worker is busy
+                done, _ = wait(futures, timeout=0.1, return_when=FIRST_COMPLETED)
+                tracker.check()
+                for future in done:
+                    collect(futures.pop(future), future.result())
+    finally:
+        if store is not None:
+            store.commit()
+
+    metric_counts = [{} for _ in metrics]
+    keyword_counts = [{} for _ in metrics]
+    for (date, _), (counts, keywords) in zip(members, results):
+        for slot, value in enumerate(counts):
+            if value is not None:
+                metric_counts[slot][date] = value
+                if keywords[slot]:
+                    keyword_counts[slot][date] = keywords[slot]
+    return metric_counts, keyword_counts
+
+
+def write_result_sheets(result_wb, metrics, metric_counts, keyword_counts, title_suffix=''):
+    for title in dict.fromkeys(metric['sheet'] for metric in metrics):
+        slots = [slot for slot, metric in enumerate(metrics) if metric['sheet'] == title]
+
+        # Create a new sheet for the query in the result workbook
+        result_sheet = result_wb.create_sheet(title=title + title_suffix)
+
+        # Write headers to the result sheet
+        result_sheet.append(['Date'] + [metrics[slot]['header'] for slot in slots])
+
+        # Sort dates in ascending order
+        sorted_dates = sorted(set().union(*(metric_counts[slot] for slot in slots)))
+
+        # Write the result to the new sheet
+        for date in sorted_dates:
+            result_sheet.append([date.strftime("%Y-%m-%d")] + [metric_counts[slot].get(date, 0) for slot in slots])
+
+        # Add a row for the total sum of counts
+        result_sheet.append(['Total'] + [sum(metric_counts[slot].values()) for slot in slots])
+
+    # Write the per-keyword hit counts of keyword-tracked metrics
+    for slot, metric in enumerate(metrics):
+        if not metric.get('keyword_sheet'):
+            continue
+        keywords = list(dict.fromkeys(word.lower() for word in metric['value'] if word))
+        daily_counts = keyword_counts[slot]
+
+        result_sheet = result_wb.create_sheet(title=metric['keyword_sheet'] + title_suffix)
+        result_sheet.append(['Date'] + keywords)
+        for date in sorted(daily_counts):
+            result_sheet.append([date.strftime("%Y-%m-%d")] + [daily_counts[date].get(word, 0) for word in keywords])
+        result_sheet.append(['Total'] + [sum(counts.get(word, 0) for counts in daily_counts.values())
+                                         for word in keywords])
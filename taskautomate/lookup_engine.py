@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .key_pool import KeyPool, NoUsableKeys, TokenBucket, parse_key_specs
+
+
+# Concurrent VirusTotal lookups for the IP checker.
+#
+# Up to `concurrency` lookups run at once on worker threads. Each thread keeps one requests.Session, so a
+# thread's lookups reuse one keep-alive connection (and TLS session) instead of connecting for every IP; a
+# Session is not guaranteed to be thread-safe, so threads do not share one. All threads draw from one token
+# bucket holding requests_per_minute tokens, which caps the whole run while still allowing a burst of that
+# size. Each lookup is sent with a key from the engine's KeyPool (see key_pool), which enforces each key's own
+# quotas. An HTTP 429 parks the key that got it, for the server's Retry-After when it sends one, otherwise
+# for an exponential backoff with jitter, and the lookup is retried with the next key (up to max_retries
+# times); an HTTP 401 rejects the key. NoUsableKeys is raised, ending the run, once no key can be used.
+# Connection errors, timeouts and 5xx answers are retried after the same backoff; a lookup still without an
+# answer after max_retries raises LookupFailed, so that the IP is never taken as looked up. None is only
+# returned for a definite answer without stats (e.g. HTTP 404 or a malformed body).
+#
+#     with LookupEngine('KEY1:4:500,KEY2', concurrency=8, requests_per_minute=1000) as engine:
+#         for ip, (stats, seconds) in zip(ips, engine.map(ips)):
+#             ...
+#
+# Results come back in the order of the IPs, whatever order the lookups finish in.
+
+# Base URL of the VirusTotal API; can be pointed at a local fake endpoint, e.g. for benchmarks
+VIRUSTOTAL_API_URL = os.environ.get('VIRUSTOTAL_API_URL', 'https://www.virustotal.com/api/v3')
+
+LOOKUP_CONCURRENCY = 8
+LOOKUP_TIMEOUT = 30
+MAX_RETRIES = 5
+# Backoff after an HTTP 429 without a Retry-After header: BACKOFF_BASE * 2 ** retry seconds, at most BACKOFF_MAX
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+class LookupFailed(Exception):
+    pass
+
+
+class LookupEngine:
+    def __init__(self, api_keys, proxy_settings=None, user_agent=None, concurrency=LOOKUP_CONCURRENCY,
+                 requests_per_minute=None, max_retries=MAX_RETRIES, api_url=VIRUSTOTAL_API_URL):
+        # api_keys: a KeyPool, a list of 'KEY[:PER_MINUTE[:PER_DAY]]' specs or a string of them separated by
+        # commas or whitespace
+        self.api_url = api_url
+        if isinstance(api_keys, KeyPool):
+            self.keys = api_keys
+        else:
+            self.keys = KeyPool.from_specs(parse_key_specs(api_keys) if isinstance(api_keys, str) else api_keys)
+        self.headers = {}
+        if user_agent:
+            self.headers['User-Agent'] = user_agent
+        self.proxy_settings = proxy_settings
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(requests_per_minute / 60 if requests_per_minute else None,
+                                  requests_per_minute)
+        self.pool = None
+        self.local = threading.local()
+        self.sessions = []
+        self.lock = threading.Lock()
+        # Number of HTTP 429 answers and the seconds keys were parked for them
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+
+    def session(self):
+        # This thread's session, created on first use
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.headers.update(self.headers)
+            session.proxies = self.proxy_settings or {}
+            session.verify = False
+            self.local.session = session
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+    def lookup(self, ip):
+        # last_analysis_stats of one IP (None when it cannot be looked up) and the seconds spent on it
+        start_time = time.perf_counter()
+        retries = 0
+        try:
+            while True:
+                key = self.keys.acquire()
+                self.bucket.acquire()
+                try:
+                    response = self.session().get(f'{self.api_url}/ip_addresses/{ip}',
+                                                  headers={'x-apikey': key.api_key}, timeout=LOOKUP_TIMEOUT)
+                except requests.RequestException as e:
+                    response, error = None, e
+                else:
+                    error = f'HTTP {response.status_code}' if response.status_code >= 500 else None
+                if error is not None:
+                    if retries >= self.max_retries:
+                        raise LookupFailed(f"Lookup of {ip} failed after {retries + 1} attempts: {error}")
+                    time.sleep(retry_delay(response, retries))
+                    retries += 1
+                    continue
+                if response.status_code == 401:
+                    self.keys.reject(key)
+                    continue
+                if response.status_code == 429:
+                    delay = retry_delay(response, key.throttled_in_a_row)
+                    self.keys.park(key, delay)
+                    with self.lock:
+                        self.throttled += 1
+                        self.throttled_seconds += delay
+                    if retries >= self.max_retries:
+                        raise LookupFailed(f"Lookup of {ip} failed after {retries + 1} attempts: HTTP 429")
+                    retries += 1
+                    continue
+                self.keys.succeeded(key)
+                return analysis_stats(response), time.perf_counter() - start_time
+        except (LookupFailed, NoUsableKeys):
+            raise
+        except Exception as e:
+            print(f"Failed to fetch reputation for {ip}: {e}")
+        return None, time.perf_counter() - start_time
+
+    def map(self, ips):
+        # (last_analysis_stats, seconds) of each IP, in order
+        if self.concurrency == 1:
+            return map(self.lookup, ips)
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='lookup')
+        return self.pool.map(self.lookup, ips)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        for session in self.sessions:
+            session.close()
+        self.sessions = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def analysis_stats(response):
+    # last_analysis_stats (engine counts by verdict) of a VirusTotal IP address response, or None when the
+    # lookup failed
+    if response.status_code == 200:
+        data = response.json()
+        if 'data' in data:
+            return data['data']['attributes']['last_analysis_stats']
+    return None
+
+
+def retry_delay(response, retry):
+    # Seconds to wait after an HTTP 429 or a failed request (response None when there was no answer): the
+    # Retry-After header (seconds or an HTTP date) when present, otherwise exponential backoff with jitter
+    # so that throttled threads do not retry in lockstep
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** retry) * random.uniform(0.5, 1.0)
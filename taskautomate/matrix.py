@@ -0,0 +1,403 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import repeat
+import os
+import time
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.utils.datetime import from_excel
+
+from .geo_baseline import GeoBaseline, user_key
+from .instrumentation import RunReport, peak_rss
+from .parse_cache import PARSE_CACHE_DIR, ParseCache
+from .result_writer import ResultWriter
+from .xlsx_reader import XlsxColumnReader
+
+# Columns written to UsersWithTwoCountries for each row of a flagged user
+MATRIX_COLUMNS = ['End Time', 'Attacker User ID', 'Attacker User Name', 'Attacker Address',
+                  'Attacker Geo Country Name', 'Name', 'Device Action']
+
+# Columns of the ImpossibleTravel sheet: one row per pair of consecutive events of a user from different
+# countries within the travel window
+TRAVEL_COLUMNS = ['Attacker User ID', 'Attacker User Name', 'From Time', 'From Address', 'From Country', 'To Time',
+                  'To Address', 'To Country', 'Time Delta']
+
+# Columns of the NewCountries sheet: one row per country a user is seen from for the first time, compared with
+# the geo baseline of earlier runs
+NEW_COUNTRY_COLUMNS = ['Attacker User ID', 'Country', 'First Seen', 'Last Seen', 'Known Countries']
+
+# Columns identifying an event when several workbooks are merged: rows equal in all of them are the same event
+# exported by more than one collector, and only the first is kept
+EVENT_KEY_COLUMNS = ['End Time', 'Attacker User ID', 'Attacker Address', 'Device Action']
+
+# 1970-01-01 and its Excel serial number (days); the geo baseline stores times as Unix seconds
+UNIX_EPOCH = datetime(1970, 1, 1)
+UNIX_EPOCH_SERIAL = 25569
+
+
+def process_excel(input_path, output_formats=('xlsx',), report_path=None, prometheus_path=None, streaming=False,
+                  travel_window=None, cache_dir=PARSE_CACHE_DIR, baseline_path=None, workers=1):
+    # input_path: workbook with a 'matrix' sheet, a folder of such workbooks, or a list of either. Several
+    # workbooks are loaded (by up to workers processes) and merged into one sheet without duplicate events
+    # (see merge_events) before the analysis.
+    # report_path / prometheus_path: optional JSON run report and Prometheus textfile with per-stage timings
+    # streaming: low-memory two-pass mode for sheets too large to load (see process_excel_streaming)
+    # cache_dir: parse cache for the loaded sheet (see parse_cache.ParseCache), None to always parse the
+    # workbook; streaming mode never loads the sheet and does not use it
+    # travel_window: optional timedelta; adds an ImpossibleTravel sheet of country changes within the window
+    # (see travel_pairs)
+    # baseline_path: optional geo baseline (see geo_baseline.GeoBaseline) to update with this workbook; adds a
+    # NewCountries sheet of the countries users are seen from for the first time
+    report = RunReport('matrix')
+    input_paths = matrix_inputs(input_path)
+    if streaming:
+        if len(input_paths) > 1:
+            raise ValueError("Streaming mode reads one workbook; merge several in the default mode")
+        output_path = process_excel_streaming(input_paths[0], output_formats, report, travel_window, baseline_path)
+        if report_path:
+            report.save(report_path, prometheus_path)
+        return output_path
+
+    # Load the matrix sheet from the existing Excel file(s)
+    frames = load_matrix_sheets(input_paths, cache_dir, workers, report)
+    if len(frames) == 1:
+        matrix_df = frames[0]
+    else:
+        with report.stage('merge', rows=sum(len(frame) for frame in frames)) as entry:
+            matrix_df = merge_events(frames)
+            entry['rows'] = len(matrix_df)
+        del frames
+
+    with report.stage('analyze', rows=len(matrix_df)):
+        # Task: Check if one user has two different countries
+        # and ignore rows where 'Attacker Address' or 'Attacker Geo Country Name' is blank.
+        # Distinct countries are counted per user in one groupby pass; rows with a blank 'Attacker User ID' are
+        # dropped by the groupby, as they never match a user ID.
+        user_ids = matrix_df['Attacker User ID']
+        has_country = matrix_df['Attacker Geo Country Name'].notnull()
+        located_df = matrix_df[has_country & matrix_df['Attacker Address'].notnull()]
+        located_countries = located_df.groupby('Attacker User ID', sort=False)['Attacker Geo Country Name'].nunique()
+        users_with_two_countries = located_countries.index[located_countries > 1]
+
+        # Create a new Excel workbook and add a sheet for users with two different countries. Rows are streamed
+        # to the output as they are produced (and to CSV / JSON Lines copies when requested).
+        output_path = 'Matrix_output.xlsx'
+        wb = ResultWriter(output_path, output_formats)
+        ws_users_with_two_countries = wb.create_sheet(title='UsersWithTwoCountries')
+
+        # Write headers to the sheet
+        headers = MATRIX_COLUMNS
+        ws_users_with_two_countries.append(headers)
+
+        # Write data for users with two different countries: each user's rows together, users in order of their
+        # first row, with a blank row when 'Attacker User ID' changes
+        user_rows = located_df[located_df['Attacker User ID'].isin(users_with_two_countries)]
+        user_numbers = user_rows.groupby('Attacker User ID', sort=False).ngroup().to_numpy()
+        order = user_numbers.argsort(kind='stable')
+        values = user_rows[headers].to_numpy(dtype=object)[order]
+        # Convert 'Attacker Username' column to numbers
+        values[:, 1] = [to_int(value) for value in values[:, 1]]
+        prev_user_number = None
+        for user_number, row in zip(user_numbers[order], values.tolist()):
+            if prev_user_number is not None and user_number != prev_user_number:
+                ws_users_with_two_countries.append([])  # Add a blank row when 'Attacker User ID' changes
+            ws_users_with_two_countries.append(row)
+            prev_user_number = user_number
+
+        # Create a new sheet for unique Attacker User ID. Candidates are the users seen more than once with an
+        # address and a country somewhere; their countries are counted over every row with a country, including
+        # rows without an address.
+        user_counts = user_ids.value_counts()
+        candidates = located_countries.index[user_counts.reindex(located_countries.index).to_numpy() > 1]
+        countries = matrix_df[has_country & user_ids.isin(candidates)].groupby(
+            'Attacker User ID', sort=False)['Attacker Geo Country Name'].nunique()
+        ws_unique_user_ids = wb.create_sheet(title='UniqueAttackerUserIDs')
+        ws_unique_user_ids.append(['Attacker User ID'])
+        for user_id in user_ids[user_ids.isin(countries.index[countries > 1])].unique():
+            ws_unique_user_ids.append([user_id])
+
+    if travel_window is not None:
+        with report.stage('travel', rows=len(located_df)) as entry:
+            # Events with a user, an address, a country and a valid 'End Time', swept per user in time order
+            times = pd.to_datetime(located_df['End Time'], errors='coerce')
+            valid = times.notnull() & located_df['Attacker User ID'].notnull()
+            events = located_df[valid]
+            times = times[valid]
+            first, second = travel_pairs(events.groupby('Attacker User ID', sort=False).ngroup().to_numpy(),
+                                         times.to_numpy(dtype='datetime64[ns]').view('int64'),
+                                         pd.factorize(events['Attacker Geo Country Name'])[0],
+                                         travel_window // timedelta(microseconds=1) * 1000)
+            values = events[MATRIX_COLUMNS].to_numpy(dtype=object)
+            values[:, 0] = times.to_numpy(dtype=object)
+            ws_travel = wb.create_sheet(title='ImpossibleTravel')
+            ws_travel.append(TRAVEL_COLUMNS)
+            for from_index, to_index in zip(first, second):
+                ws_travel.append(travel_row(values[from_index], values[to_index]))
+            entry['rows'] = len(first)
+
+    if baseline_path:
+        with report.stage('baseline', file=baseline_path, rows=len(located_df)) as entry:
+            # First and last 'End Time' of each user and country among the located rows
+            times = pd.to_datetime(located_df['End Time'], errors='coerce').dt.round('s')
+            valid = times.notnull() & located_df['Attacker User ID'].notnull()
+            seen = pd.DataFrame({
+                'user': located_df['Attacker User ID'][valid].map(user_key),
+                'country': located_df['Attacker Geo Country Name'][valid].astype(str),
+                'seconds': (times[valid] - pd.Timestamp(0)) // pd.Timedelta(seconds=1),
+            }).groupby(['user', 'country'], sort=False)['seconds'].agg(['min', 'max'])
+            with GeoBaseline(baseline_path) as baseline:
+                new_countries = baseline.merge(seen.reset_index().itertuples(index=False, name=None))
+            write_new_countries(wb, new_countries)
+            entry['rows'] = len(new_countries)
+
+    # Save the workbook with the new sheets
+    with report.stage('save', file=output_path):
+        wb.close()
+
+    if report_path:
+        report.save(report_path, prometheus_path)
+    return output_path
+
+
+def matrix_inputs(input_path):
+    # Workbooks named by input_path: a workbook, a folder (its .xlsx files, by name) or a list of either
+    paths = [input_path] if isinstance(input_path, (str, os.PathLike)) else list(input_path)
+    input_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            input_paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                               if name.lower().endswith('.xlsx') and not name.startswith('~$'))
+        else:
+            input_paths.append(path)
+    if not input_paths:
+        raise ValueError(f"No .xlsx workbooks found in {', '.join(map(str, paths))}")
+    return input_paths
+
+
+def load_matrix_sheets(input_paths, cache_dir=PARSE_CACHE_DIR, workers=1, report=None):
+    # Matrix sheets of the workbooks, in order, parsed in up to workers processes (openpyxl is CPU bound)
+    if workers > 1 and len(input_paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(input_paths))) as executor:
+            loaded = list(executor.map(load_matrix_sheet, input_paths, repeat(cache_dir)))
+    else:
+        loaded = [load_matrix_sheet(path, cache_dir) for path in input_paths]
+    if report is not None:
+        for path, (frame, seconds, rss) in zip(input_paths, loaded):
+            report.add('read', seconds, file=path, rows=len(frame), bytes_read=os.path.getsize(path), peak_rss=rss)
+    return [frame for frame, _, _ in loaded]
+
+
+def load_matrix_sheet(input_path, cache_dir=PARSE_CACHE_DIR):
+    # One workbook's matrix sheet, with the load time and peak RSS of the (possibly worker) process
+    start_time = time.perf_counter()
+    try:
+        if cache_dir:
+            with ParseCache(cache_dir) as cache:
+                frame = cache.read_excel(input_path, 'matrix')
+        else:
+            frame = pd.read_excel(input_path, sheet_name='matrix')
+    except ValueError as e:  # No 'matrix' sheet; name the workbook when several are loaded
+        raise ValueError(f"{input_path}: {e}") from e
+    return frame, time.perf_counter() - start_time, peak_rss()
+
+
+def merge_events(frames):
+    # Concatenate matrix sheets, keeping the first row of each event. Rows are compared by a 64-bit hash of
+    # their EVENT_KEY_COLUMNS, so only one integer per row is kept for the comparison. User IDs are hashed as
+    # text (see geo_baseline.user_key), as a collector whose export has blank IDs has them read as floats.
+    matrix_df = pd.concat(frames, ignore_index=True)
+    keys = matrix_df.reindex(columns=EVENT_KEY_COLUMNS)
+    keys['Attacker User ID'] = keys['Attacker User ID'].map(user_key)
+    duplicated = pd.util.hash_pandas_object(keys, index=False).duplicated()
+    return matrix_df[~duplicated.to_numpy()].reset_index(drop=True)
+
+
+def process_excel_streaming(input_path, output_formats=('xlsx',), report=None, travel_window=None, baseline_path=None):
+    # Same analysis and output as process_excel, in two passes over the sheet instead of one DataFrame.
+    # The first pass reads only the user ID, address and country columns and keeps, per user, a row count
+    # and bitmasks of the countries seen (each distinct country gets one bit), so memory grows with the
+    # number of users rather than rows. The second pass picks out the rows of the flagged users.
+    # Blank cells are written as empty cells, and numeric user IDs keep the type they have in the sheet.
+    # With a travel_window the first pass also reads 'End Time' and keeps every located event as a user,
+    # country and row number plus its time (about 20 bytes an event); 'End Time' cells must be Excel dates.
+    # With a baseline_path it keeps the first and last 'End Time' of each user and country instead.
+    report = report or RunReport('matrix')
+
+    with report.stage('aggregate', file=input_path, bytes_read=os.path.getsize(input_path)) as entry:
+        with XlsxColumnReader(input_path, 'matrix') as reader:
+            header = reader.header()
+            user_col, address_col, country_col, time_col = (
+                column_position(header, name) + 1 for name in
+                ('Attacker User ID', 'Attacker Address', 'Attacker Geo Country Name', 'End Time'))
+            read_times = travel_window is not None or bool(baseline_path)
+            columns = [user_col, address_col, country_col] + ([time_col] if read_times else [])
+            country_codes = {}
+            row_counts = {}  # Rows per user, users in order of their first row
+            located_masks = {}  # Countries of rows with an address, users in order of their first such row
+            country_masks = {}  # Countries of every row with a country
+            user_codes = {}
+            # Located events for the travel sweep; times are Excel serial numbers (days)
+            event_users, event_countries, event_rows, event_times = array('i'), array('i'), array('i'), array('d')
+            seen_times = {}  # [first, last] 'End Time' by (user_key, country) for the geo baseline
+            for entry['rows'], row in enumerate(reader.rows(columns, min_row=2), 1):
+                user_id = row_value(row, user_col - 1)
+                if is_blank(user_id):
+                    continue
+                row_counts[user_id] = row_counts.get(user_id, 0) + 1
+                country = row_value(row, country_col - 1)
+                if is_blank(country):
+                    continue
+                country_code = country_codes.setdefault(country, len(country_codes))
+                bit = 1 << country_code
+                country_masks[user_id] = country_masks.get(user_id, 0) | bit
+                if not is_blank(row_value(row, address_col - 1)):
+                    located_masks[user_id] = located_masks.get(user_id, 0) | bit
+                    end_time = row_value(row, time_col - 1) if read_times else None
+                    if isinstance(end_time, (int, float)) and not isinstance(end_time, bool):
+                        if travel_window is not None:
+                            event_users.append(user_codes.setdefault(user_id, len(user_codes)))
+                            event_countries.append(country_code)
+                            event_rows.append(entry['rows'])
+                            event_times.append(end_time)
+                        if baseline_path:
+                            bounds = seen_times.setdefault((user_key(user_id), str(country)), [end_time, end_time])
+                            bounds[0] = min(bounds[0], end_time)
+                            bounds[1] = max(bounds[1], end_time)
+
+    # Users with two different countries among rows with an address, and (for UniqueAttackerUserIDs) users seen
+    # more than once with an address somewhere and two different countries among all of their rows
+    users_with_two_countries = [user_id for user_id, mask in located_masks.items() if bin(mask).count('1') > 1]
+    unique_user_ids = [user_id for user_id, count in row_counts.items()
+                       if count > 1 and user_id in located_masks and bin(country_masks[user_id]).count('1') > 1]
+
+    travel_pairs_found = ((), ())
+    if travel_window is not None:
+        with report.stage('travel', rows=len(event_rows)) as entry:
+            travel_pairs_found = travel_pairs(np.asarray(event_users), np.asarray(event_times),
+                                              np.asarray(event_countries), travel_window / timedelta(days=1))
+            entry['rows'] = len(travel_pairs_found[0])
+    travel_rows = {event_rows[index] for pair in travel_pairs_found for index in pair}
+
+    new_countries = []
+    if baseline_path:
+        with report.stage('baseline', file=baseline_path, rows=len(seen_times)) as entry:
+            with GeoBaseline(baseline_path) as baseline:
+                new_countries = baseline.merge((user, country, serial_seconds(first), serial_seconds(last))
+                                               for (user, country), (first, last) in seen_times.items())
+            entry['rows'] = len(new_countries)
+
+    with report.stage('collect', file=input_path) as entry:
+        user_rows = {user_id: [] for user_id in users_with_two_countries}
+        travel_values = {}  # Values of the rows in ImpossibleTravel pairs, by row number
+        wb = openpyxl.load_workbook(input_path, read_only=True, data_only=True)
+        try:
+            sheet = wb['matrix']
+            header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+            positions = [column_position(header, name) for name in MATRIX_COLUMNS]
+            for row_number, row in enumerate(sheet.iter_rows(min_row=2, max_col=max(positions) + 1, values_only=True),
+                                             1):
+                values = [row_value(row, position) for position in positions]
+                if values[1] in user_rows and not is_blank(values[3]) and not is_blank(values[4]):
+                    user_rows[values[1]].append(values)
+                    entry['rows'] += 1
+                if row_number in travel_rows:
+                    travel_values[row_number] = list(values)
+        finally:
+            wb.close()
+
+    output_path = 'Matrix_output.xlsx'
+    with report.stage('save', file=output_path):
+        with ResultWriter(output_path, output_formats) as wb:
+            ws_users_with_two_countries = wb.create_sheet(title='UsersWithTwoCountries')
+            ws_users_with_two_countries.append(MATRIX_COLUMNS)
+            for index, user_id in enumerate(users_with_two_countries):
+                if index:
+                    ws_users_with_two_countries.append([])  # Add a blank row when 'Attacker User ID' changes
+                for values in user_rows.pop(user_id):
+                    values[1] = to_int(values[1])
+                    ws_users_with_two_countries.append(values)
+
+            ws_unique_user_ids = wb.create_sheet(title='UniqueAttackerUserIDs')
+            ws_unique_user_ids.append(['Attacker User ID'])
+            for user_id in unique_user_ids:
+                ws_unique_user_ids.append([user_id])
+
+            if travel_window is not None:
+                ws_travel = wb.create_sheet(title='ImpossibleTravel')
+                ws_travel.append(TRAVEL_COLUMNS)
+                for from_index, to_index in zip(*travel_pairs_found):
+                    ws_travel.append(travel_row(travel_values[event_rows[from_index]],
+                                                travel_values[event_rows[to_index]]))
+
+            if baseline_path:
+                write_new_countries(wb, new_countries)
+    return output_path
+
+
+def travel_pairs(user_codes, times, country_codes, window):
+    # Impossible-travel sweep over events given as equal-length arrays of user codes, times and country
+    # codes. Events are sorted by user, then time (stably, so simultaneous events keep sheet order), and each
+    # event is compared with the user's previous event only: a pair is flagged when the countries differ and
+    # the times are at most window apart (in the unit of times). Any two events of a user from different
+    # countries within the window have such a consecutive pair between them, so no pairwise comparison is
+    # needed and the whole sweep is one sort plus a few vectorized comparisons.
+    # Returns the (from, to) indices of the flagged pairs into the input arrays, by user and time.
+    order = np.lexsort((times, user_codes))
+    users = user_codes[order]
+    countries = country_codes[order]
+    gaps = np.diff(times[order])
+    flagged = np.flatnonzero((users[1:] == users[:-1]) & (countries[1:] != countries[:-1]) & (gaps <= window))
+    return order[flagged], order[flagged + 1]
+
+
+def travel_row(from_values, to_values):
+    # Row of the ImpossibleTravel sheet for two events, each given as its MATRIX_COLUMNS values
+    from_time, to_time = (as_datetime(values[0]) for values in (from_values, to_values))
+    return [to_int(from_values[1]), from_values[2], from_time, from_values[3], from_values[4], to_time, to_values[3],
+            to_values[4], timedelta(seconds=(to_time - from_time).total_seconds())]
+
+
+def write_new_countries(wb, new_countries):
+    # NewCountries sheet from the (user, country, first_seen, last_seen, known_countries) rows of GeoBaseline.merge
+    ws_new_countries = wb.create_sheet(title='NewCountries')
+    ws_new_countries.append(NEW_COUNTRY_COLUMNS)
+    for user, country, first_seen, last_seen, known_countries in new_countries:
+        ws_new_countries.append([to_int(user), country, UNIX_EPOCH + timedelta(seconds=first_seen),
+                                 UNIX_EPOCH + timedelta(seconds=last_seen), known_countries])
+
+
+def serial_seconds(value):
+    # Excel serial number (days) as Unix seconds, to the nearest second
+    return round((value - UNIX_EPOCH_SERIAL) * 86400)
+
+
+def as_datetime(value):
+    # 'End Time' as read by pandas (Timestamp) or openpyxl (datetime), or an Excel serial number
+    return from_excel(value) if isinstance(value, (int, float)) else value
+
+
+def column_position(header, name):
+    # 0-based position of a named column in the header row
+    try:
+        return list(header).index(name)
+    except ValueError:
+        raise KeyError(name)
+
+
+def row_value(row, position):
+    # Rows are not padded out when trailing cells are empty
+    return row[position] if position < len(row) else None
+
+
+def is_blank(value):
+    return value is None or value == ''
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return value  # Ignore non-integer values
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+
+import pandas as pd
+
+
+# On-disk cache of parsed workbook sheets, so re-running a job on the same workbook skips pd.read_excel.
+#
+# Each sheet is stored as a pandas pickle, which keeps every column as one array and loads without
+# re-parsing any cell. Parquet/Feather would need pyarrow and cannot hold the mixed-type object columns
+# of real exports (user IDs that are numbers in some rows and text in others). Entries are keyed by the
+# workbook's absolute path and sheet name, and are valid for one version of the file: when its size or
+# modification time changes the content hash decides, so a touched or copied-back workbook is still a
+# hit while an edited one is parsed again. The index lives in a SQLite file next to the entries; once the
+# entries exceed max_bytes the least recently used ones are deleted.
+#
+#     cache = ParseCache('.matrix_cache')
+#     matrix_df = cache.read_excel(input_path, 'matrix')
+
+PARSE_CACHE_DIR = '.matrix_cache'
+PARSE_CACHE_MAX_BYTES = 1 << 30
+
+
+class ParseCache:
+    def __init__(self, directory=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'))
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, path TEXT, sheet TEXT, size INTEGER, mtime INTEGER, digest TEXT, '
+            'bytes INTEGER, last_used REAL)')
+
+    def read_excel(self, path, sheet_name):
+        # pd.read_excel(path, sheet_name=sheet_name), served from the cache when the workbook is unchanged
+        frame = self.get(path, sheet_name)
+        if frame is None:
+            # The file is fingerprinted before parsing, so a workbook replaced mid-parse is not cached as new
+            signature = file_signature(path)
+            frame = pd.read_excel(path, sheet_name=sheet_name)
+            self.put(path, sheet_name, frame, signature)
+        return frame
+
+    def get(self, path, sheet_name):
+        key = entry_key(path, sheet_name)
+        row = self.connection.execute('SELECT size, mtime, digest FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        size, mtime, digest = row
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+            if stat.st_size != size or file_digest(path) != digest:
+                self.remove(key)
+                return None
+            # Same content under a new modification time
+            self.connection.execute('UPDATE entries SET mtime = ? WHERE key = ?', (stat.st_mtime_ns, key))
+
+        try:
+            frame = pd.read_pickle(self.entry_path(key))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.remove(key)
+            return None
+        self.connection.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.connection.commit()
+        return frame
+
+    def put(self, path, sheet_name, frame, signature=None):
+        key = entry_key(path, sheet_name)
+        size, mtime, digest = signature or file_signature(path)
+        entry_path = self.entry_path(key)
+        frame.to_pickle(f'{entry_path}.tmp')
+        os.replace(f'{entry_path}.tmp', entry_path)
+        self.connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (key, os.path.abspath(path), sheet_name, size, mtime, digest,
+                                 os.path.getsize(entry_path), time.time()))
+        self.evict()
+        self.connection.commit()
+
+    def evict(self):
+        # Keep the most recently used entries that fit in max_bytes
+        total = 0
+        for key, size in self.connection.execute('SELECT key, bytes FROM entries ORDER BY last_used DESC').fetchall():
+            total += size
+            if total > self.max_bytes:
+                self.remove(key)
+
+    def remove(self, key):
+        self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self.connection.commit()
+        try:
+            os.remove(self.entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def entry_key(path, sheet_name):
+    return hashlib.sha1(f'{os.path.abspath(path)}\0{sheet_name}'.encode()).hexdigest()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns, file_digest(path)
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,103 @@
+import csv
+import json
+import math
+import numbers
+import os
+import re
+
+import openpyxl
+
+
+# Streaming writer for result tables. Rows are appended sheet by sheet and written out as they come,
+# so memory stays constant however many rows a result has:
+#   'xlsx'  - one workbook at output_path, written with openpyxl's write-only mode
+#   'csv'   - one CSV file per sheet, named '<output_path without extension>_<sheet title>.csv'
+#   'jsonl' - one JSON Lines file per sheet, named the same way, with one object per row keyed by the
+#             sheet's header (the header row itself and blank separator rows are not written as records)
+# Several formats can be written in the same pass, e.g. formats=('xlsx', 'csv', 'jsonl').
+
+OUTPUT_FORMATS = ('xlsx', 'csv', 'jsonl')
+
+
+class ResultWriter:
+    def __init__(self, output_path, formats=('xlsx',)):
+        unknown = set(formats) - set(OUTPUT_FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown output formats: {', '.join(sorted(unknown))}")
+        self.output_path = output_path
+        self.formats = formats
+        self.workbook = openpyxl.Workbook(write_only=True) if 'xlsx' in formats else None
+        self.sheets = []
+
+    def create_sheet(self, title):
+        sheet = ResultSheet(self, title)
+        self.sheets.append(sheet)
+        return sheet
+
+    def sink_path(self, title, extension):
+        safe_title = re.sub(r'[^\w\-]+', '_', title).strip('_')
+        return f'{os.path.splitext(self.output_path)[0]}_{safe_title}.{extension}'
+
+    def close(self):
+        # Finish every sink and save the workbook
+        for sheet in self.sheets:
+            sheet.close()
+        if self.workbook is not None:
+            self.workbook.save(self.output_path)
+
+    def discard(self):
+        # Close the sinks without saving the workbook, e.g. after a failed run
+        for sheet in self.sheets:
+            sheet.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ResultSheet:
+    def __init__(self, writer, title):
+        self.header = None
+        self.worksheet = writer.workbook.create_sheet(title=title) if writer.workbook is not None else None
+        self.files = []
+        self.csv_writer = None
+        self.jsonl_file = None
+        if 'csv' in writer.formats:
+            csv_file = open(writer.sink_path(title, 'csv'), 'w', newline='', encoding='utf-8')
+            self.files.append(csv_file)
+            self.csv_writer = csv.writer(csv_file)
+        if 'jsonl' in writer.formats:
+            self.jsonl_file = open(writer.sink_path(title, 'jsonl'), 'w', encoding='utf-8')
+            self.files.append(self.jsonl_file)
+
+    def append(self, row):
+        row = list(row)
+        if self.worksheet is not None:
+            self.worksheet.append(row)
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(row)
+        if self.jsonl_file is not None:
+            if self.header is None:
+                # The first row of every table is its header
+                self.header = [str(value) for value in row]
+            elif row:
+                record = {key: json_value(value) for key, value in zip(self.header, row)}
+                self.jsonl_file.write(json.dumps(record, default=str) + '\n')
+
+    def close(self):
+        for file in self.files:
+            file.close()
+
+
+def json_value(value):
+    # numpy scalars from pandas frames are not JSON serializable, and NaN (empty cells) is not valid JSON
+    if isinstance(value, numbers.Number) and type(value).__module__ == 'numpy':
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
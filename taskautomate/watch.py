@@ -0,0 +1,214 @@
+from concurrent.futures import ProcessPoolExecutor
+from threading import Event
+import os
+import signal
+import zipfile
+import zlib
+
+from .kri import (KRI_METRICS, RESULT_STORE_PATH, ResultStore, dated_members, member_date, scan_member,
+                  write_result_sheets)
+from .result_writer import ResultWriter
+
+
+# Watch mode for the KRI counts: keeps Result_{month}_{year}.xlsx up to date while the month's daily exports
+# arrive, instead of running process_data once the zips are complete. The drop directory holds one folder
+# per metric source:
+#     <drop>/Query1/05.xlsx      loose daily sheets (.xlsx, .csv or .csv.gz) named by day of month
+#     <drop>/Query2/week2.zip    or zips of them, which may be replaced by bigger ones as the month goes on
+# Every poll lists both folders. A file is read once it is unchanged since the previous poll, so files still
+# being copied in are left alone. Each daily sheet is parsed only once: its counts are kept in memory and in
+# the result store (keyed like a zip member, by name, CRC-32 and size), so restarts and re-dropped copies of
+# a sheet are not parsed again. Whenever the set of daily sheets changes, the result workbook is rewritten
+# from the counts of every day seen so far. A poll that fails, e.g. because the result workbook is open in
+# Excel (which locks it on Windows) or a file disappeared while it was read, is reported and retried at the
+# next poll rather than ending the watch.
+#
+#     python -m taskautomate kri-watch drop November 2023 --interval 30
+
+# Folder of the drop directory holding each metric source's daily sheets
+SOURCE_FOLDERS = {1: 'Query1', 2: 'Query2'}
+
+
+class KriWatcher:
+    def __init__(self, drop_dir, month, year, metrics=None, store_path=RESULT_STORE_PATH, streaming=False,
+                 fast_xlsx=False, output_formats=('xlsx',), executor=None):
+        self.drop_dir = drop_dir
+        self.month = month
+        self.year = year
+        self.metrics = metrics or KRI_METRICS
+        self.streaming = streaming
+        self.fast_xlsx = fast_xlsx
+        self.output_formats = output_formats
+        self.output_path = f'Result_{month}_{year}.xlsx'
+        self.executor = executor
+        self.store = ResultStore(store_path) if store_path else None
+
+        # The metrics (as slots into self.metrics) read from each source, and their result store signature
+        self.slots = {source: [slot for slot, metric in enumerate(self.metrics) if metric['source'] == source]
+                      for source in SOURCE_FOLDERS}
+        self.signatures = {source: ResultStore.signature([self.metrics[slot] for slot in slots])
+                           for source, slots in self.slots.items()}
+
+        # Size and modification time of every file at the previous poll, and the daily sheets listed from
+        # each settled file: {path: (stat, [(date, container, info), ...])}
+        self.last_seen = {}
+        self.listings = {}
+        # Counts of every daily sheet parsed so far, by (source, container, name, CRC, size), and the sheets
+        # that could not be read, which are retried once their file changes
+        self.results = {}
+        self.failed = set()
+        # Daily sheet counted for each (source, date) in the current result workbook; nothing is written
+        # before the first sheet is counted
+        self.written = {}
+
+    def poll(self):
+        # One pass over the drop directory. Returns True when the result workbook was rewritten.
+        days = {}
+        duplicates = []
+        for source, slots in self.slots.items():
+            if not slots:
+                continue
+            for date, container, info in self.list_sheets(os.path.join(self.drop_dir, SOURCE_FOLDERS[source])):
+                key = (source, container, info.filename, info.CRC, info.file_size)
+                if key in self.failed:
+                    continue
+                if (source, date) in days and days[source, date][0] != key:
+                    duplicates.append(f"Several daily sheets for {date} in {SOURCE_FOLDERS[source]}, "
+                                      f"counting {os.path.join(container, info.filename)}")
+                days[source, date] = key, container, info
+
+        self.parse([(key, container, info) for key, container, info in days.values() if key not in self.results])
+        days = {day: key for day, (key, _, _) in days.items() if key in self.results}
+        if days == self.written:
+            return False
+        for message in duplicates:
+            print(message)
+        self.write_result(days)
+        self.written = days
+        return True
+
+    def list_sheets(self, folder):
+        # Daily sheets in a source folder, as (date, container, info) where container is the zip or folder
+        # holding the sheet. Files are only listed once they are unchanged since the previous poll.
+        if not os.path.isdir(folder):
+            return
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            try:
+                if not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+            except OSError:
+                continue  # Removed since the folder was listed
+            stat = (stat.st_size, stat.st_mtime_ns)
+            listing = self.listings.get(path)
+            if listing is None or listing[0] != stat:
+                settled = self.last_seen.get(path) == stat
+                self.last_seen[path] = stat
+                if not settled:
+                    continue
+                listing = stat, self.read_listing(folder, name)
+                self.listings[path] = listing
+            yield from listing[1]
+
+    def read_listing(self, folder, name):
+        path = os.path.join(folder, name)
+        if name.endswith('.zip'):
+            try:
+                return [(date, path, info) for date, info in dated_members(path, self.month, self.year)]
+            except zipfile.BadZipFile:
+                print(f"Skipping unreadable zip file: {path}")
+                return []
+        date = member_date(name, self.month, self.year)
+        return [(date, folder, loose_file_info(path, name))] if date is not None else []
+
+    def parse(self, sheets):
+        # Count new or changed daily sheets, reusing stored results where the sheet was seen before
+        pending = []
+        for key, container, info in sheets:
+            source = key[0]
+            result = self.store.get(info, self.signatures[source]) if self.store is not None else None
+            if result is not None:
+                self.results[key] = result
+            else:
+                pending.append((key, container, info))
+        if not pending:
+            return
+
+        arguments = [(container, info.filename, [self.metrics[slot] for slot in self.slots[key[0]]], self.streaming,
+                      self.fast_xlsx) for key, container, info in pending]
+        if self.executor is None:
+            futures = None
+        else:
+            futures = [self.executor.submit(scan_member, *args) for args in arguments]
+        for index, (key, container, info) in enumerate(pending):
+            try:
+                counts, keywords, stats = futures[index].result() if futures else scan_member(*arguments[index])
+            except Exception as e:
+                print(f"Failed to read {os.path.join(container, info.filename)}: {str(e)}")
+                self.failed.add(key)
+                continue
+            self.results[key] = counts, keywords
+            if self.store is not None:
+                self.store.put(info, self.signatures[key[0]], self.results[key])
+            print(f"Counted {os.path.join(container, info.filename)} ({stats['rows']:,} rows)")
+        if self.store is not None:
+            self.store.commit()
+
+    def write_result(self, days):
+        metric_counts = [{} for _ in self.metrics]
+        keyword_counts = [{} for _ in self.metrics]
+        for (source, date), key in days.items():
+            counts, keywords = self.results[key]
+            for slot, value, keyword_value in zip(self.slots[source], counts, keywords):
+                if value is not None:
+                    metric_counts[slot][date] = value
+                    if keyword_value:
+                        keyword_counts[slot][date] = keyword_value
+
+        with ResultWriter(self.output_path, self.output_formats) as result_wb:
+            write_result_sheets(result_wb, self.metrics, metric_counts, keyword_counts)
+        print(f"Result updated with {len({date for _, date in days})} days: {self.output_path}")
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+def loose_file_info(path, name):
+    # Describe a loose daily sheet like a zip member, so the result store keys both by name, CRC-32 and size
+    crc = 0
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+    info = zipfile.ZipInfo(name)
+    info.CRC = crc
+    info.file_size = info.compress_size = os.path.getsize(path)
+    return info
+
+
+def watch_folder(drop_dir, month, year, poll_interval=30.0, workers=1, metrics=None, store_path=RESULT_STORE_PATH,
+                 streaming=False, fast_xlsx=False, output_formats=('xlsx',), stop_event=None):
+    # Poll the drop directory every poll_interval seconds until stop_event (a threading.Event) is set, or
+    # forever when none is given
+    stop_event = stop_event or Event()
+    executor = None
+    if workers > 1:
+        # Ctrl+C stops the watch in the main process; workers ignore it rather than each printing a traceback
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=signal.signal,
+                                       initargs=(signal.SIGINT, signal.SIG_IGN))
+    watcher = KriWatcher(drop_dir, month, year, metrics, store_path, streaming, fast_xlsx, output_formats, executor)
+    print(f"Watching {drop_dir} for {month} {year} daily sheets.")
+    try:
+        while True:
+            try:
+                watcher.poll()
+            except Exception as e:
+                # The result workbook is only marked written once saved, so the next poll writes it again
+                print(f"Poll failed, retrying in {poll_interval:g} s: {e}")
+            if stop_event.wait(poll_interval):
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        watcher.close()
@@ -0,0 +1,214 @@
+from functools import lru_cache
+import posixpath
+import re
+import sqlite3
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+
+# Lightweight, column-selective reader for the active (or a named) worksheet of an xlsx file.
+#
+# openpyxl builds a cell object for every cell of every row, even in read-only mode. This reader walks
+# the worksheet XML straight out of the xlsx archive and only converts the cells of the requested
+# columns; every other cell is skipped without being decoded. Shared strings are not held in memory: the
+# sharedStrings.xml part is copied once into a temporary on-disk SQLite table, indexed by position, and each
+# string is looked up there when a cell references it. A sheet whose strings are nearly all distinct (e.g. a
+# free-text message column) needs no more memory for 1M rows than for 10k, where openpyxl reads the whole
+# table into a list.
+#
+# Values follow openpyxl's values_only rows for the types KRI sheets use (strings, numbers, booleans,
+# empty cells as None). Number formats are not applied, so date cells come back as Excel serial numbers.
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+CELL_REF = re.compile(r'([A-Z]+)(\d+)')
+
+# Shared strings kept in memory by SharedStrings: the most recently used ones, for the values that repeat
+SHARED_STRINGS_CACHE = 4096
+# Shared strings written to the SQLite table at a time while it is filled
+SHARED_STRINGS_BATCH = 1000
+
+
+def column_index(letters):
+    # 'A' -> 1, 'L' -> 12, 'AA' -> 27
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index
+
+
+class SharedStrings:
+    # Shared-strings table of an xlsx archive in a temporary on-disk SQLite database (deleted on close),
+    # indexed like a list. path is the sharedStrings part, or None when the workbook has none.
+    def __init__(self, archive, path):
+        self.connection = sqlite3.connect('')  # '' is a private temporary database on disk
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('CREATE TABLE strings (id INTEGER PRIMARY KEY, value TEXT)')
+        if path is not None and path in archive.namelist():
+            with archive.open(path) as source:
+                self.load(source)
+        self.get = lru_cache(maxsize=SHARED_STRINGS_CACHE)(self.fetch)
+
+    def load(self, source):
+        batch = []
+        root = None
+        for event, element in iterparse(source, events=('start', 'end')):
+            if root is None:
+                root = element
+            if event == 'end' and element.tag == f'{MAIN_NS}si':
+                # Rich text strings are split into several runs; join their text like openpyxl does
+                batch.append(''.join(text.text or '' for text in element.iter(f'{MAIN_NS}t')))
+                if len(batch) == SHARED_STRINGS_BATCH:
+                    self.insert(batch)
+                    root.clear()  # Drop the parsed <si> elements so memory stays flat
+        self.insert(batch)
+        self.connection.commit()
+
+    def insert(self, values):
+        self.connection.executemany('INSERT INTO strings (value) VALUES (?)', ((value,) for value in values))
+        values.clear()
+
+    def fetch(self, index):
+        # ids start at 1
+        row = self.connection.execute('SELECT value FROM strings WHERE id = ?', (index + 1,)).fetchone()
+        if row is None:
+            raise IndexError(f"Shared string {index} not found")
+        return row[0]
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    def close(self):
+        self.get.cache_clear()
+        self.connection.close()
+
+
+class XlsxColumnReader:
+    def __init__(self, fileobj, sheet_name=None):
+        # fileobj is a path or a seekable binary file, e.g. a member opened straight from an outer zip.
+        # The active worksheet is read unless sheet_name is given.
+        self.archive = zipfile.ZipFile(fileobj)
+        try:
+            self.sheet_path = self.active_sheet_path() if sheet_name is None else self.named_sheet_path(sheet_name)
+        except ValueError:
+            self.archive.close()
+            raise
+        try:
+            self.shared_strings = SharedStrings(self.archive, 'xl/sharedStrings.xml')
+        except BaseException:
+            self.archive.close()
+            raise
+
+    def close(self):
+        self.shared_strings.close()
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def active_sheet_path(self):
+        # Follow workbook.xml's activeTab to the sheet part through workbook.xml.rels
+        try:
+            active_tab, sheets = self.workbook_sheets()
+            return self.sheet_target(sheets[min(active_tab, len(sheets) - 1)][1])
+        except (KeyError, IndexError, ValueError):
+            return 'xl/worksheets/sheet1.xml'
+
+    def named_sheet_path(self, sheet_name):
+        try:
+            _, sheets = self.workbook_sheets()
+            return self.sheet_target(dict(sheets)[sheet_name])
+        except KeyError:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+
+    def workbook_sheets(self):
+        # The active tab index and the (name, relationship id) of every sheet, from workbook.xml
+        with self.archive.open('xl/workbook.xml') as workbook:
+            active_tab = 0
+            sheets = []
+            for _, element in iterparse(workbook, events=('end',)):
+                if element.tag == f'{MAIN_NS}workbookView':
+                    active_tab = int(element.get('activeTab', 0))
+                elif element.tag == f'{MAIN_NS}sheet':
+                    sheets.append((element.get('name'), element.get(f'{REL_NS}id')))
+        return active_tab, sheets
+
+    def sheet_target(self, relationship_id):
+        # Path of a sheet part inside the archive, through workbook.xml.rels
+        with self.archive.open('xl/_rels/workbook.xml.rels') as rels:
+            targets = {element.get('Id'): element.get('Target') for _, element in iterparse(rels)
+                       if element.tag == f'{PKG_REL_NS}Relationship'}
+        target = targets[relationship_id]
+        return target.lstrip('/') if target.startswith('/') else posixpath.normpath(f'xl/{target}')
+
+    def header(self):
+        # All values of the first row
+        rows = self.rows()
+        try:
+            return next(rows, ())
+        finally:
+            rows.close()
+
+    def rows(self, columns=None, min_row=1):
+        # Yield each row from min_row on as a tuple of values, padded to the highest requested column.
+        # Only the requested 1-based columns are decoded (all columns when columns is None); the rest
+        # read as None. Missing rows are yielded as empty tuples, as openpyxl does.
+        wanted = set(columns) if columns is not None else None
+        width = max(wanted) if wanted else 0
+        row_counter = 0
+        with self.archive.open(self.sheet_path) as sheet:
+            sheet_data = None
+            values = {}
+            cell_counter = 0
+            for event, element in iterparse(sheet, events=('start', 'end')):
+                tag = element.tag
+                if event == 'start':
+                    if tag == f'{MAIN_NS}row':
+                        values = {}
+                        cell_counter = 0
+                    elif tag == f'{MAIN_NS}sheetData':
+                        sheet_data = element
+                    continue
+
+                if tag == f'{MAIN_NS}c':
+                    ref = element.get('r')
+                    match = CELL_REF.match(ref) if ref else None
+                    cell_counter = column_index(match.group(1)) if match else cell_counter + 1
+                    if wanted is None or cell_counter in wanted:
+                        values[cell_counter] = self.cell_value(element)
+                elif tag == f'{MAIN_NS}row':
+                    index = int(element.get('r', row_counter + 1))
+                    sheet_data.clear()  # Drop parsed rows so memory stays flat
+
+                    # Some rows are missing from the XML
+                    while row_counter + 1 < index:
+                        row_counter += 1
+                        if row_counter >= min_row:
+                            yield ()
+                    row_counter = index
+                    if row_counter < min_row:
+                        continue
+
+                    size = width if wanted else max(values, default=0)
+                    yield tuple(values.get(col, None) for col in range(1, size + 1))
+
+    def cell_value(self, element):
+        cell_type = element.get('t', 'n')
+        if cell_type == 'inlineStr':
+            return ''.join(text.text or '' for text in element.iter(f'{MAIN_NS}t'))
+        value = element.findtext(f'{MAIN_NS}v')
+        if value is None:
+            return None
+        if cell_type == 's':
+            return self.shared_strings[int(value)]
+        if cell_type == 'n':
+            return float(value) if '.' in value or 'E' in value.upper() else int(value)
+        if cell_type == 'b':
+            return value == '1'
+        return value
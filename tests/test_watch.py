@@ -0,0 +1,36 @@
+import os
+from threading import Event
+
+import openpyxl
+
+from taskautomate import watch
+
+METRICS = [{'source': 1, 'sheet': 'Query1', 'header': 'Blocked Count',
+            'column': 'deviceAction', 'match': 'equals', 'value': 'blocked'}]
+
+
+def test_failed_result_write_is_retried_at_next_poll(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('drop/Query1')
+    with open('drop/Query1/05.csv', 'w') as file:
+        file.write('deviceAction\nblocked\nallowed\nblocked\n')
+
+    # The first save fails as if Excel had the workbook open; the second goes through and ends the watch
+    stop_event = Event()
+    write_result = watch.KriWatcher.write_result
+    calls = []
+
+    def locked_once(watcher, days):
+        calls.append(days)
+        if len(calls) == 1:
+            raise PermissionError("Permission denied: 'Result_November_2023.xlsx'")
+        write_result(watcher, days)
+        stop_event.set()
+
+    monkeypatch.setattr(watch.KriWatcher, 'write_result', locked_once)
+    watch.watch_folder('drop', 'November', '2023', poll_interval=0, metrics=METRICS, store_path=None,
+                       stop_event=stop_event)
+
+    assert len(calls) == 2
+    sheet = openpyxl.load_workbook('Result_November_2023.xlsx')['Query1']
+    assert [row for row in sheet.iter_rows(values_only=True)][1] == ('2023-11-05', 2)